@@ -0,0 +1,142 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import json
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import explosions
+
+# The name of our addon module, which the workers need to enable
+_ADDON = __name__.split(".")[0]
+
+def _lightmap_name(name):
+    return "{}_LIGHTMAPGEN.png".format(name)
+
+
+class BlenderWorkerLauncher:
+    """Runs each job in its own background Blender process. The worker entry point is the
+       worker_main function of the given module."""
+
+    def __init__(self, blender=None, module=__name__):
+        self._blender = blender if blender else bpy.app.binary_path
+        self._module = module
+
+    def run(self, snapshot, jobs):
+        expr = "import {0} as farm; farm.worker_main()".format(self._module)
+        procs = [subprocess.Popen([self._blender, "--background", snapshot, "--python-expr", expr, "--", job])
+                 for job in jobs]
+        return [i.wait() for i in procs]
+
+
+class LightmapBakeFarm:
+    """Bakes lightmaps in parallel by sharding them across several worker processes. The workers
+       bake a snapshot of the current blend file and hand back PNGs, which we pack into the
+       images that the exporter expects."""
+
+    def __init__(self, num_workers, launcher=None):
+        self._num_workers = max(1, num_workers)
+        self._launcher = launcher if launcher is not None else BlenderWorkerLauncher()
+
+    def bake(self, lightmaps, selection):
+        """Bakes a dict of {light_group: [objects]} to their lightmap images"""
+        # Step 1: Generate the UVs and images here, so everyone agrees on what gets baked where.
+        for light_group, group in lightmaps.items():
+            selection.select(group, group[0])
+            bpy.ops.object.plasma_lightmap_autobake(light_group=light_group, batch=True, stage="PREPARE")
+
+        tempdir = tempfile.mkdtemp(prefix="korman_bake")
+        try:
+            # Step 2: Snapshot the blend file for the workers
+            snapshot = os.path.join(tempdir, "snapshot.blend")
+            bpy.ops.wm.save_as_mainfile(filepath=snapshot, copy=True, check_existing=False)
+
+            # Step 3: Shard the objects. A big light group may be split across workers, but each
+            #         worker still bakes its part of a group in one go.
+            jobs = []
+            for i, shard in enumerate(self._shard(lightmaps)):
+                if not shard:
+                    continue
+                job = os.path.join(tempdir, "job{}.json".format(i))
+                with open(job, "w") as handle:
+                    json.dump({"output": tempdir, "groups": shard}, handle)
+                jobs.append(job)
+
+            # Step 4: Bake!
+            print("    Baking {} lightmap(s) in {} worker(s)...".format(sum(map(len, lightmaps.values())), len(jobs)))
+            results = self._launcher.run(snapshot, jobs)
+            failed = sum((1 for i in results if i != 0))
+            if failed:
+                raise explosions.ExportError("{} lightmap bake worker(s) failed".format(failed))
+
+            # Step 5: Pull the baked PNGs into the images and pack them up
+            for group in lightmaps.values():
+                for bo in group:
+                    name = _lightmap_name(bo.name)
+                    path = os.path.join(tempdir, name)
+                    if not os.path.isfile(path):
+                        raise explosions.ExportError("Lightmap for '{}' was not baked".format(bo.name))
+                    im = bpy.data.images[name]
+                    im.filepath_raw = path
+                    im.source = "FILE"
+                    im.reload()
+                    im.pack()
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    def _shard(self, lightmaps):
+        """Splits the objects into one [[light_group, [names]], ...] list per worker, handing the
+           biggest lightmaps out first so the workers finish at about the same time"""
+        objects = [(bo.plasma_modifiers.lightmap.resolution, bo.name, light_group)
+                   for light_group, group in lightmaps.items() for bo in group]
+        objects.sort(key=lambda x: x[0], reverse=True)
+
+        shards = [{} for i in range(min(self._num_workers, len(objects)))]
+        loads = [0] * len(shards)
+        for resolution, name, light_group in objects:
+            idx = loads.index(min(loads))
+            loads[idx] += resolution ** 2
+            shards[idx].setdefault(light_group, []).append(name)
+        return [[[light_group, names] for light_group, names in i.items()] for i in shards]
+
+
+def worker_main():
+    """Entry point for a background Blender bake worker"""
+    job = sys.argv[sys.argv.index("--") + 1]
+    with open(job, "r") as handle:
+        job = json.load(handle)
+
+    import addon_utils
+    addon_utils.enable(_ADDON, default_set=False)
+
+    scene = bpy.context.scene
+    for light_group, names in job["groups"]:
+        objects = [bpy.data.objects[i] for i in names]
+        for bo in scene.objects:
+            bo.select = False
+        for bo in objects:
+            bo.select = True
+        scene.objects.active = objects[0]
+        bpy.ops.object.plasma_lightmap_autobake(light_group=light_group, batch=True, stage="BAKE")
+
+        for bo in objects:
+            im = bpy.data.images[_lightmap_name(bo.name)]
+            im.filepath_raw = os.path.join(job["output"], im.name)
+            im.file_format = "PNG"
+            im.save()
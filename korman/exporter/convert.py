@@ -18,26 +18,35 @@ import os.path
 from PyHSPlasma import *
 import time
 
+from .. import helpers
 from . import explosions
+from . import ir
 from . import logger
 from . import manager
 from . import mesh
+from . import pagefarm
 from . import physics
 from . import rtlight
 from . import sumfile
 from . import utils
 
 class Exporter:
-    def __init__(self, op):
+    def __init__(self, op, pages=None, log=None):
         self._op = op # Blender export operator
         self._objects = []
+        self._modifiers = {}
+        self.ir = None
+
+        # Page export workers only convert and write the pages they're given
+        self.worker_pages = pages
+        self._log = log if log is not None else op.filepath
 
     @property
     def age_name(self):
         return os.path.splitext(os.path.split(self._op.filepath)[1])[0]
 
     def run(self):
-        with logger.ExportLogger(self._op.filepath) as _log:
+        with logger.ExportLogger(self._log) as _log, helpers.SelectionTracker() as self.selection:
             print("Exporting '{}.age'".format(self.age_name))
             start = time.process_time()
 
@@ -48,6 +57,8 @@ class Exporter:
             self.physics = physics.PhysicsConverter(self)
             self.light = rtlight.LightConverter(self)
             self.sumfile = sumfile.SumFile()
+            if self._op.write_ir:
+                self._init_ir()
 
             # Step 1: Create the age info and the pages
             self._export_age_info()
@@ -56,15 +67,34 @@ class Exporter:
             #         us to export (both in the Age and Object Properties)... fun
             self._collect_objects()
 
-            # Step 3: Export all the things!
-            self._export_scene_objects()
+            if self._op.page_workers and self.worker_pages is None:
+                age = bpy.context.scene.world.plasma_age
+                if age.library_name:
+                    self.report.warn("The texture library '{}' isn't used with page export workers. Its textures stay in the pages that use them.".format(age.library_name))
+                if self._op.use_texture_page:
+                    self.report.warn("Textures.prp isn't used with page export workers. Shared textures are copied into every page that uses them.")
 
-            # Step 4: Finalize...
-            self.mesh.material.finalize()
-            self.mesh.finalize()
+                # Step 2.1: Bake the static lighting here, once, so every worker gets the same lighting.
+                self.mesh.bake_static_lighting(self._objects)
+
+                # Step 3: Hand the pages off to background export workers.
+                print("\n[Page Export Workers]")
+                pagefarm.PageExportFarm(self._op.page_workers).export(self, self._objects)
+            else:
+                self._export_objects()
+
+            # Step 4.1: Dump everything we converted into the intermediate representation
+            if self.ir is not None:
+                age = bpy.context.scene.world.plasma_age
+                self.ir.save(self, age.export(self), age.age_sdl)
 
             # Step 5: FINALLY. Let's write the PRPs and crap.
-            self.mgr.save_age(self._op.filepath)
+            if self.worker_pages is None:
+                self.mgr.save_age(self._op.filepath)
+            else:
+                # Workers only write their own pages. The parent process writes everything else.
+                for name in self.worker_pages:
+                    self.mgr.flush_page(self.mgr.get_page_location(name))
 
             # Step 5.1: Save out the export report.
             #           If the export fails and this doesn't save, we have bigger problems than
@@ -75,6 +105,14 @@ class Exporter:
             end = time.process_time()
             print("\nExported {}.age in {:.2f} seconds".format(self.age_name, end-start))
 
+    def _init_ir(self):
+        # The IR is read back from the converted objects at the end, so everything has to still
+        # be in memory at that point.
+        if self._op.stream_pages or self._op.page_workers:
+            raise explosions.ExportError("The intermediate representation can't be written when streaming pages or using page workers")
+        path = os.path.split(self._op.filepath)[0]
+        self.ir = ir.IRWriter(os.path.join(path, "{}_ir".format(self.age_name)))
+
     def _collect_objects(self):
         # Grab a naive listing of enabled pages
         age = bpy.context.scene.world.plasma_age
@@ -125,7 +163,9 @@ class Exporter:
         for page in age_info.pages:
             if page.enabled:
                 mgr.create_page(age_name, page.name, page.seq_suffix)
-        mgr.create_builtins(age_name, self._op.use_texture_page)
+        # No one page export worker sees every user of a texture, so the workers have to keep all of
+        # the textures in the pages that use them.
+        mgr.create_builtins(age_name, self._op.use_texture_page and not self._op.page_workers)
 
     def _export_actor(self, so, bo):
         """Exports a Coordinate Interface if we need one"""
@@ -159,8 +199,54 @@ class Exporter:
             ci.localToParent = utils.matrix44(bl.matrix_local)
             ci.parentToLocal = ci.localToParent.inverse()
 
-    def _export_scene_objects(self):
+    def _export_objects(self):
+        # Step 2.1: Figure out which of those objects are actors now, so that all of the
+        #           converters get the same answer without asking over and over again.
+        #           Do this for every object, even in a page export worker, because children
+        #           in other pages make their parents actors.
+        self.mgr.analyze_actors(self._objects)
+
+        if self.worker_pages is not None:
+            # Step 2.2: The parent process has already baked the lighting, so all we need to do
+            #           is toss everything that isn't in our pages.
+            locations = frozenset((self.mgr.get_page_location(i) for i in self.worker_pages))
+            self._objects = [i for i in self._objects if self.mgr.get_location(i) in locations]
+            self.mgr.set_worker_pages(locations)
+        else:
+            # Step 2.2: Generate all of the static lighting up front, in as few bakes as we can.
+            self.mesh.bake_static_lighting(self._objects)
+
+        if self._op.stream_pages:
+            # Step 3: Export each page all the way down to the disk before starting the next one,
+            #         so we only ever have one page of objects in memory.
+            self._export_pages()
+        else:
+            # Step 2.3: Snapshot all of the mesh data and start building the geometry in the background.
+            self.mesh.prepare_geometry(self._objects)
+
+            # Step 3: Export all the things!
+            self._export_scene_objects(self._objects)
+
+            # Step 4: Finalize...
+            self.mesh.material.finalize()
+            self.mesh.finalize()
+
+    def _export_pages(self):
+        pages = {}
         for bl_obj in self._objects:
+            pages.setdefault(self.mgr.get_location(bl_obj), []).append(bl_obj)
+
+        for location, objects in pages.items():
+            print("\n[Page '{}']".format(self.mgr.get_page_name(location)))
+            print("    Exporting {} object(s)".format(len(objects)))
+            self.mesh.prepare_geometry(objects)
+            self._export_scene_objects(objects)
+            self.mesh.material.finalize(partial=True)
+            self.mesh.finalize(location)
+            self.mgr.flush_page(location)
+
+    def _export_scene_objects(self, objects):
+        for bl_obj in objects:
             print("\n[SceneObject '{}']".format(bl_obj.name))
 
             # First pass: do things specific to this object type.
@@ -182,13 +268,22 @@ class Exporter:
             export_fn(sceneobject, bl_obj)
 
             # And now we puke out the modifiers...
-            for mod in bl_obj.plasma_modifiers.modifiers:
+            for mod in self.get_modifiers(bl_obj):
                 print("    Exporting '{}' modifier as '{}'".format(mod.bl_label, mod.display_name))
                 mod.export(self, bl_obj, sceneobject)
 
             # Last, but not least, apply synch settings
             bl_obj.plasma_net.export(bl_obj, sceneobject)
 
+    def get_modifiers(self, bo):
+        """Returns the enabled Plasma Modifiers on a Blender Object in display order. The result
+           is cached for the duration of the export."""
+        modifiers = self._modifiers.get(bo)
+        if modifiers is None:
+            modifiers = tuple(sorted(bo.plasma_modifiers.modifiers, key=lambda x: x.display_order))
+            self._modifiers[bo] = modifiers
+        return modifiers
+
     def _export_empty_blobj(self, so, bo):
         # We don't need to do anything here. This function just makes sure we don't error out
         # or add a silly special case :(
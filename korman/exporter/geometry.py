@@ -0,0 +1,83 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+def build_geometry(snapshot):
+    """Converts a mesh._GeometrySnapshot into deduplicated vertex and index buffers for each material.
+       This is all NumPy, so it doesn't need Blender or PyHSPlasma."""
+    num_faces = len(snapshot.faces)
+    num_uvs = snapshot.uvs.shape[2]
+
+    # Blender tessfaces are triangles if the fourth vertex index is zero
+    quads = snapshot.faces[:, 3] != 0
+    valid = numpy.ones((num_faces, 4), dtype=bool)
+    valid[:, 3] = quads
+
+    vertex_colors = numpy.empty((num_faces, 4, 4), dtype=numpy.uint8)
+    vertex_colors[:, :, :3] = (snapshot.colors * 255).astype(numpy.uint8)
+    vertex_colors[:, :, 3] = (snapshot.alphas * 255).astype(numpy.uint8)
+
+    # Every face corner is a potential vertex. Identical (vertex, color, uv) corners are merged.
+    fields = [("vertex", numpy.int32), ("color", numpy.uint8, 4)]
+    if num_uvs:
+        fields.append(("uvs", numpy.float32, (num_uvs * 2,)))
+    record = numpy.dtype(fields)
+    corners = numpy.empty((num_faces, 4), dtype=record)
+    corners["vertex"] = snapshot.faces
+    corners["color"] = vertex_colors
+    if num_uvs:
+        corners["uvs"] = snapshot.uvs.reshape((num_faces, 4, num_uvs * 2))
+
+    # Convert to triangles, if need be...
+    tris = numpy.tile(numpy.array((0, 1, 2, 0, 2, 3), dtype=numpy.int32), (num_faces, 1))
+    tris += (numpy.arange(num_faces, dtype=numpy.int32) * 4)[:, numpy.newaxis]
+    tri_valid = numpy.ones((num_faces, 6), dtype=bool)
+    tri_valid[:, 3:] = quads[:, numpy.newaxis]
+
+    results = []
+    for slot in snapshot.slots:
+        in_slot = snapshot.face_materials == slot
+        corner_ids = numpy.flatnonzero((valid & in_slot[:, numpy.newaxis]).ravel())
+        if not len(corner_ids):
+            results.append(None)
+            continue
+
+        # Keep the vertices in the order they are first used, just like walking the faces would
+        keys = corners.ravel()[corner_ids]
+        void = numpy.dtype((numpy.void, record.itemsize))
+        unique, first, inverse = numpy.unique(keys.view(void), return_index=True, return_inverse=True)
+        order = numpy.argsort(first, kind="mergesort")
+        rank = numpy.empty(len(order), dtype=numpy.int32)
+        rank[order] = numpy.arange(len(order), dtype=numpy.int32)
+
+        remap = numpy.full(num_faces * 4, -1, dtype=numpy.int32)
+        remap[corner_ids] = rank[inverse]
+        indices = remap[tris[in_slot][tri_valid[in_slot]]]
+
+        vertices = keys[first[order]]
+        if num_uvs:
+            uvs = vertices["uvs"].reshape((len(vertices), num_uvs, 2))
+        else:
+            uvs = numpy.zeros((len(vertices), 0, 2), dtype=numpy.float32)
+        geometry = {
+            "positions": snapshot.positions[vertices["vertex"]],
+            "normals": snapshot.normals[vertices["vertex"]],
+            "colors": vertices["color"],
+            "uvs": uvs,
+            "indices": indices,
+        }
+        results.append(geometry)
+    return results
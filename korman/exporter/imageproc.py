@@ -0,0 +1,87 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+def from_bytes(data, width, height):
+    """Wraps raw RGBA8 pixel data in a (height, width, 4) array"""
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape((height, width, 4))
+
+def classify_alpha(pixels):
+    """Classifies the alpha channel of an image as 'NONE' (opaque), 'BINARY' (on/off) or 'FULL'"""
+    alpha = pixels[..., 3]
+    if (alpha == 255).all():
+        return "NONE"
+    if ((alpha == 0) | (alpha == 255)).all():
+        return "BINARY"
+    return "FULL"
+
+def _box_weights(src, dst):
+    """Makes a (dst, src) matrix of how much each source texel covers each destination texel"""
+    scale = src / dst
+    edges = numpy.arange(dst + 1, dtype=numpy.float64) * scale
+    texels = numpy.arange(src, dtype=numpy.float64)
+    lo = numpy.maximum(edges[:-1, numpy.newaxis], texels[numpy.newaxis, :])
+    hi = numpy.minimum(edges[1:, numpy.newaxis], texels[numpy.newaxis, :] + 1.0)
+    return (numpy.clip(hi - lo, 0.0, None) / scale).astype(numpy.float32)
+
+def _bilinear_coords(src, dst):
+    coords = numpy.clip((numpy.arange(dst) + 0.5) * (src / dst) - 0.5, 0.0, src - 1)
+    lo = numpy.floor(coords).astype(numpy.int32)
+    hi = numpy.minimum(lo + 1, src - 1)
+    return lo, hi, (coords - lo).astype(numpy.float32)
+
+def resample(pixels, width, height, filter="BOX"):
+    """Resamples a (height, width, 4) array of pixels to a new size, returning a new array"""
+    src_height, src_width = pixels.shape[:2]
+    if (src_width, src_height) == (width, height):
+        return pixels
+
+    if filter == "NEAREST":
+        ys = ((numpy.arange(height) + 0.5) * (src_height / height)).astype(numpy.int32)
+        xs = ((numpy.arange(width) + 0.5) * (src_width / width)).astype(numpy.int32)
+        return pixels[ys][:, xs]
+
+    pixels = pixels.astype(numpy.float32)
+    if filter == "BILINEAR":
+        y0, y1, wy = _bilinear_coords(src_height, height)
+        x0, x1, wx = _bilinear_coords(src_width, width)
+        wy, wx = wy[:, numpy.newaxis, numpy.newaxis], wx[numpy.newaxis, :, numpy.newaxis]
+        top = pixels[y0][:, x0] * (1.0 - wx) + pixels[y0][:, x1] * wx
+        bottom = pixels[y1][:, x0] * (1.0 - wx) + pixels[y1][:, x1] * wx
+        result = top * (1.0 - wy) + bottom * wy
+    else:
+        # Area averaging, done one axis at a time
+        rows = numpy.tensordot(_box_weights(src_height, height), pixels, axes=(1, 0))
+        result = numpy.tensordot(rows, _box_weights(src_width, width), axes=(1, 1)).transpose((0, 2, 1))
+    return numpy.clip(numpy.rint(result), 0, 255).astype(numpy.uint8)
+
+def generate_levels(pixels, num_levels, calc_alpha=False, bgra=False, quiet=False):
+    """Yields the uncompressed data for each mip level of an image, largest first. Only one level
+       is held in memory at a time."""
+    for i in range(num_levels):
+        if i:
+            height, width = pixels.shape[:2]
+            pixels = resample(pixels, max(width // 2, 1), max(height // 2, 1), "BOX")
+        if not quiet:
+            print("        Level #{}: {}x{}".format(i, pixels.shape[1], pixels.shape[0]))
+
+        level = pixels
+        if calc_alpha:
+            level = level.copy()
+            level[..., 3] = level[..., :3].sum(axis=2, dtype=numpy.uint16) // 3
+        if bgra:
+            level = level[..., (2, 1, 0, 3)]
+        yield numpy.ascontiguousarray(level).tobytes()
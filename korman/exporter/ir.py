@@ -0,0 +1,578 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Korman's intermediate scene representation (IR)
+
+The exporter can write a copy of everything it converted to a directory. The directory holds
+scene.json, which describes the age, and buffers.bin, which holds the geometry and texture data
+that scene.json points into. This module doesn't need Blender, so it doubles as a standalone
+tool that rebuilds the PRPs from the IR. The tool can even target another version of Plasma:
+
+    python ir.py <ir directory> <output directory> [--version pvPots] [--allow-incomplete]
+
+The IR doesn't hold everything yet (eg logic and RT lights). The tool refuses to build an age
+from an IR that's missing anything unless it's told to with --allow-incomplete.
+"""
+
+import argparse
+import json
+import os.path
+import sys
+
+import numpy
+from PyHSPlasma import *
+
+try:
+    from . import irbuffers
+    from . import sumfile
+except ImportError:
+    # Running as the standalone tool
+    import irbuffers
+    import sumfile
+
+# Bump this whenever the format of the IR changes
+IR_VERSION = 2
+
+_SCENE = "scene.json"
+_BUFFERS = "buffers.bin"
+
+# Plasma classes that the IR knows how to rebuild. Anything else the exporter made is left out.
+# The BuiltIn page is always rebuilt from scratch, so its contents don't count.
+_IR_CLASSES = frozenset(("plSceneNode", "plSceneObject", "plCoordinateInterface", "plDrawInterface",
+                         "plDrawableSpans", "hsGMaterial", "plLayer", "plMipmap",
+                         "plSimulationInterface", "plGenericPhysical"))
+
+_LAYER_STATE = ("blendFlags", "clampFlags", "shadeFlags", "ZFlags", "miscFlags")
+_LAYER_COLORS = ("ambient", "preshade", "runtime", "specular")
+_PHYSICAL_PROPS = ("friction", "restitution", "mass", "memberGroup", "reportGroup", "collideGroup", "LOSDBs")
+_SIM_PROPS = ("kStartInactive", "kCameraAvoidObject", "kPinned")
+
+def _color(color):
+    return [color.red, color.green, color.blue, color.alpha]
+
+def _matrix(hsmat):
+    return [hsmat[i, j] for i in range(4) for j in range(4)]
+
+def _to_matrix(values):
+    hsmat = hsMatrix44()
+    for i in range(4):
+        for j in range(4):
+            hsmat[i, j] = values[i * 4 + j]
+    return hsmat
+
+def _get_page_filename(version, ageName, pageName):
+    # Same as ExportManager, but the version is up to the caller
+    chapter = "_District_" if version <= pvMoul else "_"
+    return "{}{}{}.prp".format(ageName, chapter, pageName)
+
+
+class IRWriter:
+    """Collects the exported age as it's converted and writes it out as the IR. The converters hand
+       over geometry, textures, and physics meshes as they make them. Everything else is read
+       back from the converted Plasma objects at the end."""
+
+    def __init__(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._path = path
+        self._buffers = irbuffers.BufferWriter(os.path.join(path, _BUFFERS))
+        self._dspans = {}
+        self._drawables = []
+        self._mipmaps = []
+        self._library = None
+        self._physicals = []
+
+    def _ref(self, mgr, key):
+        if key is None:
+            return None
+        # Texture library keys have no page in the age, so they get a page of None
+        page = mgr.get_page_name(key.location) if key.location in mgr.get_pages().values() else None
+        return {"page": page, "name": key.name}
+
+    def _light_ref(self, mgr, key):
+        # The lights can be any of several classes, so they have to say which
+        ref = self._ref(mgr, key)
+        ref["class"] = plFactory.ClassName(key.type)
+        return ref
+
+    def add_span(self, mgr, dspan, idx, geospan, data):
+        """Records a plGeometrySpan added to a plDrawableSpans along with its vertex data"""
+        record = self._get_dspan(mgr, dspan)
+        if data is None:
+            data = {"positions": numpy.zeros((0, 3), dtype=numpy.float32),
+                    "normals": numpy.zeros((0, 3), dtype=numpy.float32),
+                    "colors": numpy.zeros((0, 4), dtype=numpy.uint8),
+                    "uvs": numpy.zeros((0, geospan.format, 2), dtype=numpy.float32),
+                    "indices": numpy.zeros(0, dtype=numpy.int32)}
+        span = {"index": idx, "material": self._ref(mgr, geospan.material), "format": geospan.format,
+                "localToWorld": _matrix(geospan.localToWorld), "worldToLocal": _matrix(geospan.worldToLocal),
+                "permaLights": [self._light_ref(mgr, i) for i in geospan.permaLights],
+                "permaProjs": [self._light_ref(mgr, i) for i in geospan.permaProjs]}
+        for i in ("positions", "normals", "colors", "uvs", "indices"):
+            span[i] = self._buffers.add(data[i])
+        record["spans"].append(span)
+
+    def add_di_index(self, mgr, dspan, idx, indices):
+        """Records a plDISpanIndex added to a plDrawableSpans"""
+        self._get_dspan(mgr, dspan)["di_indices"].append({"index": idx, "indices": list(indices)})
+
+    def add_drawables(self, mgr, diface, drawables):
+        """Records the drawables of a plDrawInterface"""
+        self._drawables.append({"page": mgr.get_page_name(diface.key.location), "name": diface.key.name,
+                                "drawables": [[self._ref(mgr, key), idx] for key, idx in drawables]})
+
+    def add_mipmaps(self, mgr, mipmaps, levels, width, height, compType, dxtLevel):
+        """Records the copies of a plMipmap and their compressed (or not) level data"""
+        levels = [self._buffers.add(numpy.frombuffer(i, dtype=numpy.uint8)) for i in levels]
+        for mipmap in mipmaps:
+            # The texture memory limit can unload the mipmaps before the IR is saved, so everything
+            # has to be copied out of them now.
+            record = self._ref(mgr, mipmap.key)
+            record.update({"width": width, "height": height, "numLevels": len(levels),
+                           "compType": compType, "dxtLevel": dxtLevel, "levels": levels})
+            if record["page"] is None:
+                self._library = {"name": mgr.get_texture_library_name(), "seqPrefix": mipmap.key.location.prefix}
+            self._mipmaps.append(record)
+
+    def add_physical_mesh(self, physical, vertices, indices=None):
+        """Records the vertices (and indices) that a plGenericPhysical's bounds are made from"""
+        vertices = numpy.array([(i.X, i.Y, i.Z) for i in vertices], dtype=numpy.float32).reshape((-1, 3))
+        record = {"physical": physical, "vertices": self._buffers.add(vertices)}
+        if indices is not None:
+            record["indices"] = self._buffers.add(numpy.array(indices, dtype=numpy.int32))
+        self._physicals.append(record)
+
+    def _get_dspan(self, mgr, dspan):
+        name = (mgr.get_page_name(dspan.key.location), dspan.key.name)
+        record = self._dspans.get(name)
+        if record is None:
+            record = {"page": name[0], "name": name[1], "criteria": dspan.criteria,
+                      "renderLevel": dspan.renderLevel, "spans": [], "di_indices": []}
+            self._dspans[name] = record
+        return record
+
+    def save(self, exporter, age_info, age_sdl):
+        """Reads back everything else from the converted age and writes the IR to the disk"""
+        mgr = exporter.mgr
+        print("\n[Intermediate Representation]")
+
+        scene = {
+            "version": IR_VERSION,
+            "plasma_version": exporter._op.version,
+            "age": {"name": age_info.name, "seqPrefix": age_info.seqPrefix, "dayLength": age_info.dayLength,
+                    "lingerTime": age_info.lingerTime, "maxCapacity": age_info.maxCapacity,
+                    "startDateTime": age_info.startDateTime, "sdl": age_sdl},
+            "fni": list(mgr.get_fni_lines()),
+            "pages": [],
+            "library": self._library,
+            "dspans": list(self._dspans.values()),
+            "drawables": self._drawables,
+            "mipmaps": self._mipmaps,
+            "objects": [],
+            "materials": [],
+            "layers": [],
+            "physicals": [],
+        }
+
+        # The pages themselves, and whatever isn't in the IR.
+        skipped = {}
+        pages = mgr.get_pages()
+        for name, location in sorted(pages.items(), key=lambda x: x[1].page):
+            builtin = bool(location.flags & plLocation.kBuiltIn)
+            scene["pages"].append({"name": name, "id": location.page, "builtin": builtin})
+            if builtin:
+                continue
+            for index in mgr.getTypes(location):
+                class_name = plFactory.ClassName(index)
+                if class_name not in _IR_CLASSES:
+                    skipped[class_name] = skipped.get(class_name, 0) + len(mgr.getKeys(location, index))
+        for class_name, count in sorted(skipped.items()):
+            exporter.report.warn("{} {}(s) can't be stored in the IR yet".format(count, class_name), indent=1)
+        if skipped:
+            exporter.report.warn("The IR is incomplete, so it will only be rebuilt with --allow-incomplete", indent=1)
+        scene["skipped"] = skipped
+
+        for name, location in pages.items():
+            if location.flags & plLocation.kBuiltIn:
+                continue
+            for key in mgr.getKeys(location, plFactory.ClassIndex("plSceneObject")):
+                scene["objects"].append(self._get_object(mgr, name, key.object))
+            for key in mgr.getKeys(location, plFactory.ClassIndex("hsGMaterial")):
+                scene["materials"].append(self._get_material(mgr, name, key.object))
+            for key in mgr.getKeys(location, plFactory.ClassIndex("plLayer")):
+                scene["layers"].append(self._get_layer(mgr, name, key.object))
+
+        for record in self._physicals:
+            physical = record.pop("physical")
+            record.update(self._ref(mgr, physical.key))
+            record["boundsType"] = physical.boundsType
+            record["pos"] = [physical.pos.X, physical.pos.Y, physical.pos.Z]
+            record["rot"] = [physical.rot.X, physical.rot.Y, physical.rot.Z, physical.rot.W]
+            for i in _PHYSICAL_PROPS:
+                record[i] = getattr(physical, i)
+            record["properties"] = [i for i in _SIM_PROPS if physical.getProperty(getattr(plSimulationInterface, i))]
+            scene["physicals"].append(record)
+
+        self._buffers.close()
+        with open(os.path.join(self._path, _SCENE), "w") as handle:
+            json.dump(scene, handle, indent=1)
+        print("    Wrote {} object(s) to '{}'".format(len(scene["objects"]), self._path))
+
+    def _get_object(self, mgr, page, so):
+        record = {"page": page, "name": so.key.name, "coord": None, "sim": None}
+        if so.coord is not None:
+            ci = so.coord.object
+            record["coord"] = {"name": so.coord.name, "localToWorld": _matrix(ci.localToWorld),
+                               "worldToLocal": _matrix(ci.worldToLocal), "localToParent": _matrix(ci.localToParent),
+                               "parentToLocal": _matrix(ci.parentToLocal),
+                               "children": [self._ref(mgr, i) for i in ci.children]}
+        if so.sim is not None:
+            sim = so.sim.object
+            record["sim"] = {"name": so.sim.name, "physical": self._ref(mgr, sim.physical),
+                             "properties": [i for i in _SIM_PROPS if sim.getProperty(getattr(plSimulationInterface, i))]}
+        return record
+
+    def _get_material(self, mgr, page, hsgmat):
+        return {"page": page, "name": hsgmat.key.name, "compFlags": hsgmat.compFlags,
+                "layers": [self._ref(mgr, i) for i in hsgmat.layers],
+                "piggyBacks": [self._ref(mgr, i) for i in hsgmat.piggyBacks]}
+
+    def _get_layer(self, mgr, page, layer):
+        record = {"page": page, "name": layer.key.name, "texture": self._ref(mgr, layer.texture),
+                  "texture_class": plFactory.ClassName(layer.texture.type) if layer.texture is not None else None,
+                  "opacity": layer.opacity, "UVWSrc": layer.UVWSrc, "transform": _matrix(layer.transform)}
+        for i in _LAYER_STATE:
+            record[i] = getattr(layer.state, i)
+        for i in _LAYER_COLORS:
+            record[i] = _color(getattr(layer, i))
+        return record
+
+
+class IRBuilder:
+    """Builds the PRPs (and .age, .fni, and .sum) of an age from its IR"""
+
+    def __init__(self, path, version=None, allow_incomplete=False):
+        with open(os.path.join(path, _SCENE), "r") as handle:
+            self._scene = json.load(handle)
+        if self._scene["version"] != IR_VERSION:
+            raise ValueError("'{}' is IR version {}, but this is version {}".format(path, self._scene["version"], IR_VERSION))
+
+        self._buffers = irbuffers.BufferReader(os.path.join(path, _BUFFERS))
+
+        self.mgr = plResManager()
+        self.mgr.setVer(version if version is not None else globals()[self._scene["plasma_version"]])
+        self._allow_incomplete = allow_incomplete
+        self._keys = {}
+        self._nodes = {}
+        self._pages = {}
+
+    def _add(self, ref, pl):
+        """Adds a new object at a page named by an IR reference and remembers its key"""
+        location = self._pages[ref["page"]]
+        self.mgr.AddObject(location, pl)
+        self._keys[(ref["page"], type(pl).__name__, ref["name"])] = pl.key
+        return pl
+
+    def _find(self, pClass, ref):
+        if ref is None:
+            return None
+        return self._keys[(ref["page"], pClass.__name__, ref["name"])]
+
+    def build(self, path):
+        scene, age = self._scene, self._scene["age"]
+        print("Building '{}.age' from the IR".format(age["name"]))
+
+        # The exporter leaves out what the IR can't hold yet (eg logic and RT lights), so an age
+        # built from it would quietly be missing parts.
+        if scene["skipped"]:
+            missing = ", ".join(("{} {}(s)".format(count, class_name) for class_name, count in sorted(scene["skipped"].items())))
+            if not self._allow_incomplete:
+                raise ValueError("The IR is missing {}, so the age would be incomplete".format(missing))
+            print("WARNING: The IR is missing {}. The age will be incomplete!".format(missing))
+
+        age_info = plAgeInfo()
+        for i in ("name", "seqPrefix", "dayLength", "lingerTime", "maxCapacity", "startDateTime"):
+            setattr(age_info, i, age[i])
+        self.mgr.AddAge(age_info)
+        for page in scene["pages"]:
+            self._create_page(age_info, page)
+        if scene["library"] is not None:
+            self._create_library(scene["library"], path)
+
+        # Textures and materials have to exist before anything can use them
+        for record in scene["mipmaps"]:
+            mipmap = plMipmap(name=record["name"], width=record["width"], height=record["height"],
+                              numLevels=record["numLevels"], compType=record["compType"],
+                              format=plBitmap.kRGB8888, dxtLevel=record["dxtLevel"])
+            for i, level in enumerate(record["levels"]):
+                mipmap.setLevel(i, self._buffers.get(level).tobytes())
+            if record["page"] is None:
+                # Replace the older copy of a library texture, just like the exporter does
+                for key in self.mgr.getKeys(self._pages[None], plFactory.ClassIndex("plMipmap")):
+                    if key.name == record["name"]:
+                        self.mgr.DelObject(key)
+                        break
+            self._add(record, mipmap)
+        for record in scene["layers"]:
+            self._build_layer(record)
+        for record in scene["materials"]:
+            hsgmat = self._add(record, hsGMaterial(record["name"]))
+            hsgmat.compFlags = record["compFlags"]
+            for i in record["layers"]:
+                hsgmat.addLayer(self._find(plLayer, i))
+            for i in record["piggyBacks"]:
+                hsgmat.addPiggyBack(self._find(plLayer, i))
+
+        for record in scene["objects"]:
+            so = self._add(record, plSceneObject(record["name"]))
+            node = self._nodes[self._pages[record["page"]]]
+            node.addSceneObject(so.key)
+            so.sceneNode = node.key
+        for record in scene["objects"]:
+            self._build_interfaces(record)
+        for record in scene["dspans"]:
+            self._build_dspan(record)
+        for record in scene["drawables"]:
+            so = self._find(plSceneObject, record).object
+            diface = self._add(record, plDrawInterface(record["name"]))
+            diface.owner = so.key
+            so.draw = diface.key
+            for ref, idx in record["drawables"]:
+                diface.addDrawable(self._find(plDrawableSpans, ref), idx)
+        owners = {(i["sim"]["physical"]["page"], i["sim"]["physical"]["name"]): i
+                  for i in scene["objects"] if i["sim"] is not None and i["sim"]["physical"] is not None}
+        for record in scene["physicals"]:
+            self._build_physical(record, owners.get((record["page"], record["name"])))
+
+        self._write(path, age_info)
+
+    def _create_page(self, age_info, page):
+        version = self.mgr.getVer()
+        location = plLocation(version)
+        location.prefix = age_info.seqPrefix
+        location.page = page["id"]
+        if page["builtin"]:
+            location.flags |= plLocation.kBuiltIn
+        self._pages[page["name"]] = location
+
+        info = plPageInfo()
+        info.age = age_info.name
+        info.page = page["name"]
+        info.location = location
+        self.mgr.AddPage(info)
+
+        if page["builtin"]:
+            self._nodes[location] = None
+            if page["name"] == "BuiltIn" and self._scene["age"]["sdl"]:
+                sdl = self._add({"page": page["name"], "name": "AgeSDLHook"}, plSceneObject("AgeSDLHook"))
+                pfm = self._add({"page": page["name"], "name": "VeryVerySpecialPythonFileMod"},
+                                plPythonFileMod("VeryVerySpecialPythonFileMod"))
+                pfm.filename = age_info.name
+                sdl.addModifier(pfm.key)
+        else:
+            age_info.addPage((page["name"], page["id"], 0))
+            if version <= pvPots:
+                node = plSceneNode("{}_District_{}".format(age_info.name, page["name"]))
+            else:
+                node = plSceneNode("{}_{}".format(age_info.name, page["name"]))
+            self._nodes[location] = node
+            self.mgr.AddObject(location, node)
+
+    def _create_library(self, library, path):
+        # Other ages share the library, so keep whatever is already in it
+        filename = os.path.join(path, _get_page_filename(self.mgr.getVer(), library["name"], "Textures"))
+        if os.path.isfile(filename):
+            self._pages[None] = self.mgr.ReadPage(filename).location
+            return
+
+        location = plLocation(self.mgr.getVer())
+        location.prefix = library["seqPrefix"]
+        location.page = 0
+        self._pages[None] = location
+
+        info = plPageInfo()
+        info.age = library["name"]
+        info.page = "Textures"
+        info.location = location
+        self.mgr.AddPage(info)
+
+    def _build_layer(self, record):
+        layer = self._add(record, plLayer(record["name"]))
+        texture = record["texture"]
+        if texture is not None:
+            # Only plMipmaps are in the IR, so anything else (eg an environment map) is left out
+            key = self._keys.get((texture["page"], record["texture_class"], texture["name"]))
+            if key is None:
+                print("    Layer '{}' uses {} '{}', which isn't in the IR".format(record["name"], record["texture_class"],
+                                                                            texture["name"]))
+            layer.texture = key
+        layer.opacity = record["opacity"]
+        layer.UVWSrc = record["UVWSrc"]
+        layer.transform = _to_matrix(record["transform"])
+        for i in _LAYER_STATE:
+            setattr(layer.state, i, record[i])
+        for i in _LAYER_COLORS:
+            setattr(layer, i, hsColorRGBA(*record[i]))
+
+    def _build_interfaces(self, record):
+        so = self._find(plSceneObject, record).object
+        if record["coord"] is not None:
+            coord = record["coord"]
+            ci = self._add({"page": record["page"], "name": coord["name"]}, plCoordinateInterface(coord["name"]))
+            for i in ("localToWorld", "worldToLocal", "localToParent", "parentToLocal"):
+                setattr(ci, i, _to_matrix(coord[i]))
+            for i in coord["children"]:
+                ci.addChild(self._find(plSceneObject, i))
+            ci.owner = so.key
+            so.coord = ci.key
+        if record["sim"] is not None:
+            sim = record["sim"]
+            simIface = self._add({"page": record["page"], "name": sim["name"]}, plSimulationInterface(sim["name"]))
+            for i in sim["properties"]:
+                simIface.setProperty(getattr(plSimulationInterface, i), True)
+            simIface.owner = so.key
+            so.sim = simIface.key
+
+    def _build_dspan(self, record):
+        location = self._pages[record["page"]]
+        dspan = self._add(record, plDrawableSpans(record["name"]))
+        dspan.criteria = record["criteria"]
+        dspan.renderLevel = record["renderLevel"]
+        dspan.sceneNode = self._nodes[location].key
+
+        for span in record["spans"]:
+            geospan = plGeometrySpan()
+            geospan.material = self._find(hsGMaterial, span["material"])
+            geospan.format = span["format"]
+            geospan.localToWorld = _to_matrix(span["localToWorld"])
+            geospan.worldToLocal = _to_matrix(span["worldToLocal"])
+            for i in span["permaLights"]:
+                key = self._keys.get((i["page"], i["class"], i["name"]))
+                if key is not None:
+                    geospan.addPermaLight(key)
+            for i in span["permaProjs"]:
+                key = self._keys.get((i["page"], i["class"], i["name"]))
+                if key is not None:
+                    geospan.addPermaProjs(key)
+
+            vertices = []
+            buffers = [self._buffers.get(span[i]).tolist() for i in ("positions", "normals", "colors", "uvs")]
+            for position, normal, color, uvs in zip(*buffers):
+                geoVertex = plGeometrySpan.TempVertex()
+                geoVertex.position = hsVector3(*position)
+                geoVertex.normal = hsVector3(*normal)
+                geoVertex.color = hsColor32(*color)
+                geoVertex.uvs = [hsVector3(uv[0], uv[1], 0.0) for uv in uvs]
+                vertices.append(geoVertex)
+            geospan.indices = self._buffers.get(span["indices"]).tolist()
+            geospan.vertices = vertices
+            if dspan.addSourceSpan(geospan) != span["index"]:
+                raise ValueError("Span {} of '{}' is out of order".format(span["index"], record["name"]))
+
+        for di in record["di_indices"]:
+            dii = plDISpanIndex()
+            dii.indices = di["indices"]
+            dspan.addDIIndex(dii)
+        print("    Composing '{}'".format(record["name"]))
+        dspan.composeGeometry(True, True)
+
+    def _build_physical(self, record, owner):
+        physical = self._add(record, plGenericPhysical(record["name"]))
+        physical.boundsType = record["boundsType"]
+        physical.pos = hsVector3(*record["pos"])
+        physical.rot = hsQuat(*record["rot"])
+
+        vertices = [hsVector3(*i) for i in self._buffers.get(record["vertices"]).tolist()]
+        if record["boundsType"] == plSimDefs.kBoxBounds:
+            physical.calcBoxBounds(vertices)
+        elif record["boundsType"] == plSimDefs.kSphereBounds:
+            physical.calcSphereBounds(vertices)
+        else:
+            physical.verts = vertices
+            if "indices" in record:
+                physical.indices = self._buffers.get(record["indices"]).tolist()
+
+        for i in _PHYSICAL_PROPS:
+            setattr(physical, i, record[i])
+        for i in record["properties"]:
+            physical.setProperty(getattr(plSimulationInterface, i), True)
+
+        # The physical belongs to whichever object's simulation interface points at it
+        if owner is not None:
+            physical.object = self._find(plSceneObject, owner)
+            physical.sceneNode = self._nodes[self._pages[owner["page"]]].key
+            sim = {"page": owner["page"], "name": owner["sim"]["name"]}
+            self._find(plSimulationInterface, sim).object.physical = physical.key
+
+    def _write(self, path, age_info):
+        version = self.mgr.getVer()
+        age_sum = sumfile.SumFile()
+        agePath = os.path.join(path, "{}.age".format(age_info.name))
+        self.mgr.WriteAge(agePath, age_info)
+        age_sum.append(agePath)
+
+        enc = plEncryptedStream.kEncXtea if version <= pvMoul else plEncryptedStream.kEncAES
+        fniPath = os.path.join(path, "{}.fni".format(age_info.name))
+        with plEncryptedStream(version).open(fniPath, fmWrite, enc) as stream:
+            for line in self._scene["fni"]:
+                stream.writeLine(line)
+        age_sum.append(fniPath)
+
+        for page in self._scene["pages"]:
+            f = os.path.join(path, _get_page_filename(version, age_info.name, page["name"]))
+            print("    Writing '{}'".format(os.path.basename(f)))
+            self.mgr.WritePage(f, self.mgr.FindPage(self._pages[page["name"]]))
+            age_sum.append(f)
+        if version != pvMoul:
+            age_sum.write(os.path.join(path, "{}.sum".format(age_info.name)), version)
+
+        library = self._scene["library"]
+        if library is not None:
+            library_sum = sumfile.SumFile()
+            library_info = plAgeInfo()
+            library_info.name = library["name"]
+            library_info.seqPrefix = library["seqPrefix"]
+            library_info.addPage(("Textures", 0, 0))
+            libraryPath = os.path.join(path, "{}.age".format(library["name"]))
+            self.mgr.WriteAge(libraryPath, library_info)
+            library_sum.append(libraryPath)
+
+            f = os.path.join(path, _get_page_filename(version, library["name"], "Textures"))
+            self.mgr.WritePage(f, self.mgr.FindPage(self._pages[None]))
+            library_sum.append(f)
+            if version != pvMoul:
+                library_sum.write(os.path.join(path, "{}.sum".format(library["name"])), version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the PRPs of an age from Korman's intermediate representation")
+    parser.add_argument("ir", help="IR directory written by the exporter")
+    parser.add_argument("output", help="directory to write the age to")
+    parser.add_argument("--version", choices=("pvPrime", "pvPots", "pvMoul", "pvEoa", "pvHex"),
+                        help="Plasma version to target (defaults to the one the IR was exported for)")
+    parser.add_argument("--allow-incomplete", action="store_true",
+                        help="build the age even if the IR is missing things that the exporter couldn't store")
+    args = parser.parse_args()
+
+    try:
+        builder = IRBuilder(args.ir, globals()[args.version] if args.version else None, args.allow_incomplete)
+        builder.build(args.output)
+    except ValueError as error:
+        print("ERROR: {}".format(error))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
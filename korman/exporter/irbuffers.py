@@ -0,0 +1,57 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The binary half of the IR: one file of arrays that scene.json points into. Every array starts on
+an aligned offset, so the whole file can be memory mapped and read back without copying."""
+
+import numpy
+import os.path
+
+_ALIGNMENT = 16
+
+class BufferWriter:
+    """Appends NumPy arrays to a buffer file and describes where each one went"""
+
+    def __init__(self, path):
+        self._handle = open(path, "wb")
+
+    def add(self, array):
+        """Writes an array and returns its descriptor"""
+        array = numpy.ascontiguousarray(array)
+        offset = self._handle.tell()
+        padding = -offset % _ALIGNMENT
+        if padding:
+            self._handle.write(b"\0" * padding)
+            offset += padding
+        self._handle.write(array.tobytes())
+        return {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+
+    def close(self):
+        self._handle.close()
+
+
+class BufferReader:
+    """Reads arrays back out of a buffer file by their descriptors"""
+
+    def __init__(self, path):
+        if os.path.getsize(path):
+            self._buffers = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+        else:
+            self._buffers = numpy.zeros(0, dtype=numpy.uint8)
+
+    def get(self, desc):
+        dtype = numpy.dtype(desc["dtype"])
+        count = int(numpy.prod(desc["shape"]))
+        return numpy.frombuffer(self._buffers, dtype, count, desc["offset"]).reshape(desc["shape"])
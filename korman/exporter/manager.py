@@ -16,9 +16,11 @@
 import bpy
 import os.path
 from PyHSPlasma import *
+import shutil
 import weakref
 
 from . import explosions
+from . import sumfile
 
 # These objects have to be in the plSceneNode pool in order to be loaded...
 # NOTE: We are using Factory indices because I doubt all of these classes are implemented.
@@ -49,8 +51,13 @@ class ExportManager:
         self.mgr = plResManager()
         self.mgr.setVer(globals()[exporter._op.version])
 
+        self._actors = {}
+        self._flushed_keys = {}
+        self._flushed_pages = set()
+        self._library = None
         self._nodes = {}
         self._pages = {}
+        self._worker_locations = None
 
         # cheap inheritance
         for i in dir(self.mgr):
@@ -82,6 +89,13 @@ class ExportManager:
                 name = bl.name
             pl = pl(name)
 
+        if location in self._flushed_pages:
+            raise explosions.ExportError("Page '{}' has already been written, so '{}' can't be added to it".format(
+                self.get_page_name(location), pl.key.name))
+        if self._worker_locations is not None and location not in self._worker_locations:
+            # Another worker (or the parent) writes that page, so this would silently go missing
+            raise explosions.ExportError("'{}' belongs in page '{}', which this page export worker doesn't write. Logic that reaches into another page can't be exported with page workers.".format(
+                pl.key.name, self.get_page_name(location)))
         self.mgr.AddObject(location, pl)
         node = self._nodes[location]
         if node: # All objects must be in the scene node
@@ -169,6 +183,10 @@ class ExportManager:
         key = self.find_key(pClass, bl, name, so)
         if key is None:
             key = self.add_object(pl=pClass, name=name, bl=bl, so=so).key
+        elif key.location in self._flushed_pages:
+            # The key is still fine to reference, but the object is long gone, and our caller wants it
+            raise explosions.ExportError("'{}' is in page '{}', which has already been written. Something in a later page refers to it.".format(
+                key.name, self.get_page_name(key.location)))
         return key
 
     def find_key(self, pClass, bl=None, name=None, so=None):
@@ -183,15 +201,93 @@ class ExportManager:
             name = bl.name
 
         index = plFactory.ClassIndex(pClass.__name__)
+        flushed = self._flushed_keys.get(location)
+        if flushed is not None:
+            return flushed.get((index, name))
         for key in self.mgr.getKeys(location, index):
             if name == key.name:
                 return key
         return None
 
+    def set_worker_pages(self, locations):
+        """Limits a page export worker to adding objects to the pages it writes"""
+        self._worker_locations = frozenset(locations)
+
     def get_location(self, bl):
         """Returns the Page Location of a given Blender Object"""
         return self._pages[bl.plasma_object.page]
 
+    def get_texture_library(self):
+        """Gets the Location of the shared texture library page, loading what's already in the
+           library from disk the first time through"""
+        if self._library is not None:
+            return self._library
+
+        age = bpy.context.scene.world.plasma_age
+        if not age.library_name:
+            return None
+        if self._exporter().worker_pages is not None:
+            # Page export workers don't write the library, so the textures stay in the pages
+            return None
+        if age.library_prefix == age.seq_prefix:
+            raise explosions.ExportError("The texture library can't have the same ID as the age")
+
+        path = os.path.split(self._exporter()._op.filepath)[0]
+        filename = os.path.join(path, self._get_page_filename(age.library_name, "Textures"))
+        if os.path.isfile(filename):
+            print("\n[Texture Library '{}']".format(age.library_name))
+            print("    Loading existing library page")
+            info = self.mgr.ReadPage(filename)
+            location = info.location
+            if location.prefix != age.library_prefix:
+                raise explosions.ExportError("Texture library '{}' has ID {}, not {}".format(
+                    age.library_name, location.prefix, age.library_prefix))
+        else:
+            location = plLocation(self.mgr.getVer())
+            location.prefix = age.library_prefix
+            location.page = 0
+
+            info = plPageInfo()
+            info.age = age.library_name
+            info.page = "Textures"
+            info.location = location
+            self.mgr.AddPage(info)
+        self._library = location
+        return location
+
+    def add_library_texture(self, mipmap):
+        """Adds a plMipmap to the texture library, replacing any older copy of it"""
+        index = plFactory.ClassIndex("plMipmap")
+        for key in self.mgr.getKeys(self._library, index):
+            if key.name == mipmap.key.name:
+                self.mgr.DelObject(key)
+                break
+        self.mgr.AddObject(self._library, mipmap)
+
+    def get_page_name(self, location):
+        """Returns the name of the page at a given Location"""
+        if location == self._library:
+            return "{} (library)".format(bpy.context.scene.world.plasma_age.library_name)
+        for name, page in self._pages.items():
+            # The default page is registered under an empty name, too
+            if name and page == location:
+                return name
+        return None
+
+    def get_pages(self):
+        """Returns a dict of every page's name and Location"""
+        return {name: location for name, location in self._pages.items() if name}
+
+    def get_page_location(self, name):
+        """Returns the Page Location of a named page, if it has been created"""
+        return self._pages.get(name)
+
+    def get_texture_library_name(self):
+        """Returns the name of the texture library, if any textures were exported to it"""
+        if self._library is None:
+            return None
+        return bpy.context.scene.world.plasma_age.library_name
+
     def get_scene_node(self, location=None, bl=None):
         """Gets a Plasma Page's plSceneNode key"""
         assert (location is not None) ^ (bl is not None)
@@ -200,39 +296,89 @@ class ExportManager:
             location = self._pages[bl.plasma_object.page]
         return self._nodes[location].key
 
-    def get_textures_page(self, key):
-        """Gets the appropriate page for a texture for a given plLayer"""
+    def get_textures_page(self, key, users=None):
+        """Gets the appropriate page for a texture for a given plLayer. If the pages that use the
+           texture are known, textures that only one page uses stay in that page."""
         # The point of this is to account for per-page textures...
-        if "Textures" in self._pages:
+        if "Textures" in self._pages and (users is None or len(users) > 1):
             return self._pages["Textures"]
         else:
             return key.location
 
-    def has_coordiface(self, bo):
+    def analyze_actors(self, objects):
+        """Determines which of the given Blender Objects need to be actors (and therefore have a
+           CoordinateInterface) before anything is converted."""
+        print("\n[Actor Analysis]")
+        for bo in objects:
+            self._actors[bo] = self._find_actor_reasons(bo)
+
+        # Children hang off of their parent's CoordinateInterface, so the parent has to be an
+        # actor too. Only bother with parents that are actually being exported.
+        for bo in objects:
+            parent = bo.parent
+            if parent is not None and parent in self._actors:
+                self._actors[parent].append("has child '{}'".format(bo.name))
+
+        for bo, reasons in self._actors.items():
+            if reasons:
+                print("    '{}': {}".format(bo.name, ", ".join(reasons)))
+
+    def _find_actor_reasons(self, bo):
+        reasons = []
         if bo.type in {"CAMERA", "EMPTY", "LAMP"}:
-            return True
+            reasons.append("is a {}".format(bo.type.lower()))
         if bo.parent is not None:
-            return True
+            reasons.append("is parented to '{}'".format(bo.parent.name))
 
-        for mod in bo.plasma_modifiers.modifiers:
-            if mod.enabled:
-                if mod.requires_actor:
-                    return True
-        return False
+        for mod in self._exporter().get_modifiers(bo):
+            if mod.requires_actor:
+                reasons.append("'{}' requires it".format(mod.display_name))
+        return reasons
+
+    def has_coordiface(self, bo):
+        reasons = self._actors.get(bo)
+        if reasons is None:
+            # Not one of the objects we analyzed up front (eg a region referenced by a node)
+            reasons = self._find_actor_reasons(bo)
+            self._actors[bo] = reasons
+        return bool(reasons)
 
     def save_age(self, path):
         relpath, ageFile = os.path.split(path)
         ageName = os.path.splitext(ageFile)[0]
-        sumfile = self._exporter().sumfile
+        age_sum = self._exporter().sumfile
 
-        sumfile.append(path)
+        age_sum.append(path)
         self.mgr.WriteAge(path, self._age_info)
         self._write_fni(relpath, ageName)
         self._write_pages(relpath, ageName)
 
         if self.getVer() != pvMoul:
             sumpath = os.path.join(relpath, "{}.sum".format(ageName))
-            sumfile.write(sumpath, self.getVer())
+            age_sum.write(sumpath, self.getVer())
+
+        if self._library is not None:
+            self._write_library(relpath)
+
+    def _write_library(self, path):
+        """Writes out the shared texture library as its very own age"""
+        age = bpy.context.scene.world.plasma_age
+        library_sum = sumfile.SumFile()
+
+        age_info = plAgeInfo()
+        age_info.name = age.library_name
+        age_info.seqPrefix = age.library_prefix
+        age_info.addPage(("Textures", 0, 0))
+        age_path = os.path.join(path, "{}.age".format(age.library_name))
+        self.mgr.WriteAge(age_path, age_info)
+        library_sum.append(age_path)
+
+        filename = os.path.join(path, self._get_page_filename(age.library_name, "Textures"))
+        self.mgr.WritePage(filename, self.mgr.FindPage(self._library))
+        library_sum.append(filename)
+
+        if self.getVer() != pvMoul:
+            library_sum.write(os.path.join(path, "{}.sum".format(age.library_name)), self.getVer())
 
     def _write_fni(self, path, ageName):
         if self.mgr.getVer() <= pvMoul:
@@ -242,26 +388,68 @@ class ExportManager:
         fname = os.path.join(path, "{}.fni".format(ageName))
 
         with plEncryptedStream(self.mgr.getVer()).open(fname, fmWrite, enc) as stream:
-            fni = bpy.context.scene.world.plasma_fni
-            stream.writeLine("Graphics.Renderer.SetClearColor {} {} {}".format(*fni.clear_color))
-            if fni.fog_method != "none":
-                stream.writeLine("Graphics.Renderer.Fog.SetDefColor {} {} {}".format(*fni.fog_color))
-            if fni.fog_method == "linear":
-                stream.writeLine("Graphics.Renderer.Fog.SetDefLinear {} {} {}".format(fni.fog_start, fni.fog_end, fni.fog_density))
-            elif fni.fog_method == "exp2":
-                stream.writeLine("Graphics.Renderer.Fog.SetDefExp2 {} {}".format(fni.fog_end, fni.fog_density))
-            stream.writeLine("Graphics.Renderer.SetYon {}".format(fni.yon))
+            for line in self.get_fni_lines():
+                stream.writeLine(line)
         self._exporter().sumfile.append(fname)
 
+    def get_fni_lines(self):
+        """Yields the console commands that go into the age's .fni file"""
+        fni = bpy.context.scene.world.plasma_fni
+        yield "Graphics.Renderer.SetClearColor {} {} {}".format(*fni.clear_color)
+        if fni.fog_method != "none":
+            yield "Graphics.Renderer.Fog.SetDefColor {} {} {}".format(*fni.fog_color)
+        if fni.fog_method == "linear":
+            yield "Graphics.Renderer.Fog.SetDefLinear {} {} {}".format(fni.fog_start, fni.fog_end, fni.fog_density)
+        elif fni.fog_method == "exp2":
+            yield "Graphics.Renderer.Fog.SetDefExp2 {} {}".format(fni.fog_end, fni.fog_density)
+        yield "Graphics.Renderer.SetYon {}".format(fni.yon)
+
+    def flush_page(self, location):
+        """Writes a finished page out early and unloads it to free up memory"""
+        path, ageFile = os.path.split(self._exporter()._op.filepath)
+        ageName = os.path.splitext(ageFile)[0]
+        if location in self._flushed_pages:
+            return
+        print("    Flushing page '{}' to disk".format(self.get_page_name(location)))
+        self._write_page(path, ageName, location)
+
+        # Hang onto the keys so that other pages can still reference what was in this one
+        self._flushed_keys[location] = {(index, key.name): key for index in self.mgr.getTypes(location)
+                                                               for key in self.mgr.getKeys(location, index)}
+        self.mgr.UnloadPage(location)
+        self._flushed_pages.add(location)
+
+    def add_external_page(self, location, source):
+        """Moves a page that someone else (eg a page export worker) wrote in the source directory
+           into place"""
+        path, ageFile = os.path.split(self._exporter()._op.filepath)
+        ageName = os.path.splitext(ageFile)[0]
+        filename = self._get_page_filename(ageName, self.get_page_name(location))
+        src = os.path.join(source, filename)
+        if not os.path.isfile(src):
+            raise explosions.ExportError("Page '{}' was not exported".format(self.get_page_name(location)))
+
+        f = os.path.join(path, filename)
+        shutil.move(src, f)
+        self._exporter().sumfile.append(f)
+        self._flushed_pages.add(location)
+
+    def _get_page_filename(self, ageName, pageName):
+        # I know that plAgeInfo has its own way of doing this, but we'd have
+        # to do some looping and stuff. This is easier.
+        if self.mgr.getVer() <= pvMoul:
+            chapter = "_District_"
+        else:
+            chapter = "_"
+        return "{}{}{}.prp".format(ageName, chapter, pageName)
+
+    def _write_page(self, path, ageName, loc):
+        page = self.mgr.FindPage(loc) # not cached because it's C++ owned
+        f = os.path.join(path, self._get_page_filename(ageName, page.page))
+        self.mgr.WritePage(f, page)
+        self._exporter().sumfile.append(f)
+
     def _write_pages(self, path, ageName):
         for loc in self._pages.values():
-            page = self.mgr.FindPage(loc) # not cached because it's C++ owned
-            # I know that plAgeInfo has its own way of doing this, but we'd have
-            # to do some looping and stuff. This is easier.
-            if self.mgr.getVer() <= pvMoul:
-                chapter = "_District_"
-            else:
-                chapter = "_"
-            f = os.path.join(path, "{}{}{}.prp".format(ageName, chapter, page.page))
-            self.mgr.WritePage(f, page)
-            self._exporter().sumfile.append(f)
+            if loc not in self._flushed_pages:
+                self._write_page(path, ageName, loc)
@@ -15,19 +15,88 @@
 
 import bpy
 import bgl
+import hashlib
 import math
+import numpy
 import os.path
 from PyHSPlasma import *
 import weakref
 
 from . import explosions
 from .. import helpers
+from . import imageproc
 from . import utils
 
 # BGL doesn't know about this as of Blender 2.74
 bgl.GL_GENERATE_MIPMAP = 0x8191
 bgl.GL_BGRA = 0x80E1
 
+_MiB = 1024 * 1024
+
+# Textures are never downscaled below this to fit into a texture budget
+_MIN_BUDGET_TEXTURE_SIZE = 64
+_DEFAULT_TEXTURE_PRIORITY = 5
+
+def _get_num_levels(key, width, height):
+    if not key.mipmap:
+        return 1
+    numLevels = math.floor(math.log(max(width, height), 2)) + 1
+
+    # Major Workaround Ahoy
+    # There is a bug in Cyan's level size algorithm that causes it to not allocate enough memory
+    # for the color block in certain mipmaps. I personally have encountered an access violation on
+    # 1x1 DXT5 mip levels -- the code only allocates an alpha block and not a color block. Paradox
+    # reports that if any dimension is smaller than 4px in a mip level, OpenGL doesn't like Cyan generated
+    # data. So, we're going to lop off the last two mip levels, which should be 1px and 2px as the smallest.
+    # This bug is basically unfixable without crazy hacks because of the way Plasma reads in texture data.
+    #     "<Deledrius> I feel like any texture at a 1x1 level is essentially academic.  I mean, JPEG/DXT
+    #                  doesn't even compress that, and what is it?  Just the average color of the whole
+    #                  texture in a single pixel?"
+    # :)
+    # If your mipmap only has 2 levels (or less), then you deserve to phail...
+    return max(numLevels - 2, 2)
+
+def _get_alpha_type(key):
+    if key.calc_alpha:
+        return "FULL"
+    if not key.use_alpha:
+        return "NONE"
+    return key.alpha_type if key.alpha_type is not None else "FULL"
+
+def _get_texture_format(key, width, height):
+    """Returns the (compression, dxt level) that a texture should be exported with"""
+    compress = key.compress
+    if compress is None:
+        # DXT works on 4x4 blocks, so tiny unmipped images have to stay uncompressed
+        compress = key.mipmap or (width >= 4 and height >= 4)
+    if not compress:
+        return (plBitmap.kUncompressed, plBitmap.kDXTError)
+
+    # DXT1 can do punchthrough alpha, so only images with partial alpha need DXT5
+    if _get_alpha_type(key) == "FULL":
+        return (plBitmap.kDirectXCompression, plBitmap.kDXT5)
+    return (plBitmap.kDirectXCompression, plBitmap.kDXT1)
+
+def _get_naive_format(key):
+    """Returns the format that we used to pick before bothering to analyze anything"""
+    if not key.mipmap:
+        return (plBitmap.kUncompressed, plBitmap.kDXTError)
+    dxt = plBitmap.kDXT5 if key.use_alpha or key.calc_alpha else plBitmap.kDXT1
+    return (plBitmap.kDirectXCompression, dxt)
+
+def _estimate_texture_bytes(key, width, height, fmt=None):
+    """Estimates how much memory a texture will use after it's been exported"""
+    compression, dxt = fmt if fmt is not None else _get_texture_format(key, width, height)
+    num_bytes = 0
+    for i in range(_get_num_levels(key, width, height)):
+        level_width, level_height = max(width >> i, 1), max(height >> i, 1)
+        if compression == plBitmap.kUncompressed:
+            num_bytes += level_width * level_height * 4
+        else:
+            block_size = 16 if dxt == plBitmap.kDXT5 else 8
+            num_bytes += max(level_width // 4, 1) * max(level_height // 4, 1) * block_size
+    return num_bytes
+
 class _GLTexture:
     def __init__(self, blimg):
         self._ownit = (blimg.bindcode == 0)
@@ -106,8 +175,73 @@ class _GLTexture:
         return int(buf[0])
 
 
+class _PixelsTexture:
+    """A CPU-only stand-in for _GLTexture that reads the image through bpy.types.Image.pixels. This
+       works in background mode, where there is no OpenGL context to load images into."""
+
+    def __init__(self, blimg):
+        self._blimg = blimg
+        self._levels = None
+        self._mipmap = False
+
+    def __enter__(self):
+        width, height = self._blimg.size
+        pixels = self._blimg.pixels
+        buf = numpy.empty(len(pixels), dtype=numpy.float32)
+        try:
+            pixels.foreach_get(buf)
+        except AttributeError:
+            # Older Blenders can only slice the pixels, which is VERY VERY VERY slow...
+            buf[:] = pixels[:]
+
+        # Pixels are floats in the image's channel count, but GL hands us RGBA bytes
+        channels = self._blimg.channels
+        buf = numpy.rint(numpy.clip(buf, 0.0, 1.0) * 255.0).astype(numpy.uint8).reshape((height, width, channels))
+        if channels == 4:
+            rgba = buf
+        else:
+            rgba = numpy.full((height, width, 4), 255, dtype=numpy.uint8)
+            if channels == 3:
+                rgba[..., :3] = buf
+            else:
+                # Greyscale, maybe with alpha
+                rgba[..., :3] = buf[..., :1]
+                if channels == 2:
+                    rgba[..., 3] = buf[..., 1]
+        self._levels = [rgba]
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._levels = None
+
+    def generate_mipmap(self):
+        """Generates all mip levels for this texture"""
+        self._mipmap = True
+
+    def get_level_data(self, level=0, calc_alpha=False, bgra=False, quiet=False):
+        """Gets the uncompressed pixel data for a requested mip level, optionally calculating the alpha
+           channel from the image color data
+        """
+        assert level == 0 or self._mipmap
+        while len(self._levels) <= level:
+            height, width = self._levels[-1].shape[:2]
+            self._levels.append(imageproc.resample(self._levels[-1], max(width // 2, 1), max(height // 2, 1), "BOX"))
+        pixels = self._levels[level]
+        if not quiet:
+            print("        Level #{}: {}x{}".format(level, pixels.shape[1], pixels.shape[0]))
+        return next(imageproc.generate_levels(pixels, 1, calc_alpha, bgra, quiet=True))
+
+
+def _get_texture_source(image):
+    """Picks how to read an image: through OpenGL if we have it, or through the pixels if we don't"""
+    if bpy.app.background:
+        return _PixelsTexture(image)
+    return _GLTexture(image)
+
+
 class _Texture:
-    def __init__(self, texture=None, image=None, use_alpha=None, force_calc_alpha=False):
+    def __init__(self, texture=None, image=None, use_alpha=None, force_calc_alpha=False, mipmap=None,
+                 compress=None):
         assert (texture or image)
 
         if texture is not None:
@@ -115,9 +249,17 @@ class _Texture:
                 image = texture.image
             self.calc_alpha = texture.use_calculate_alpha
             self.mipmap = texture.use_mipmap
+            self.max_size = int(texture.plasma_layer.max_size)
+            self.priority = texture.plasma_layer.texture_priority
+            self.library = texture.plasma_layer.use_library
         else:
             self.calc_alpha = False
             self.mipmap = False
+            self.max_size = 0
+            self.priority = _DEFAULT_TEXTURE_PRIORITY
+            self.library = False
+        if mipmap is not None:
+            self.mipmap = mipmap
 
         if force_calc_alpha or self.calc_alpha:
             self.calc_alpha = True
@@ -127,6 +269,9 @@ class _Texture:
         else:
             self.use_alpha = use_alpha
 
+        # None lets the exporter decide whether or not to compress the texture
+        self.compress = compress
+        self.alpha_type = None
         self.image = image
 
     def __eq__(self, other):
@@ -142,7 +287,12 @@ class _Texture:
         return hash(self.image.name) ^ hash(self.calc_alpha)
 
     def __str__(self):
-        if self.mipmap:
+        return self.get_name(*self.image.size)
+
+    def get_name(self, width, height):
+        """Names the texture after the format it gets exported with at the given size"""
+        compression, dxt = _get_texture_format(self, width, height)
+        if compression == plBitmap.kDirectXCompression:
             name = self._change_extension(self.image.name, ".dds")
         else:
             name = self._change_extension(self.image.name, ".bmp")
@@ -163,13 +313,24 @@ class _Texture:
             self.use_alpha = True
         if other.mipmap:
             self.mipmap = True
+        # The texture has to be good enough for its most demanding user
+        if not other.max_size or (self.max_size and other.max_size > self.max_size):
+            self.max_size = other.max_size
+        self.priority = max(self.priority, other.priority)
+        if self.compress is None:
+            self.compress = other.compress
+        if other.library:
+            self.library = True
 
 
 class MaterialConverter:
     def __init__(self, exporter):
         self._obj2mat = {}
         self._exporter = weakref.ref(exporter)
+        self._materials = {}
+        self._finished = {}
         self._pending = {}
+        self._texture_pages = {}
         self._alphatest = {}
         self._tex_exporters = {
             "ENVRIONMENT_MAP": self._export_texture_type_environment_map,
@@ -179,6 +340,24 @@ class MaterialConverter:
 
     def export_material(self, bo, bm):
         """Exports a Blender Material as an hsGMaterial"""
+        # Most objects using a material in a given page can share the same hsGMaterial. Some of
+        # them need their own copy, though, because something object specific is poked into it.
+        cache_key = self._get_material_cache_key(bo, bm)
+        hsgmat_key = self._materials.get(cache_key)
+        if hsgmat_key is None:
+            hsgmat_key = self._export_material(bo, bm)
+            self._materials[cache_key] = hsgmat_key
+        else:
+            print("    Reusing Material '{}'".format(bm.name))
+
+        # Cache this material for later
+        if bo in self._obj2mat:
+            self._obj2mat[bo].append(hsgmat_key)
+        else:
+            self._obj2mat[bo] = [hsgmat_key]
+        return hsgmat_key
+
+    def _export_material(self, bo, bm):
         print("    Exporting Material '{}'".format(bm.name))
 
         hsgmat = self._mgr.add_object(hsGMaterial, name=bm.name, bl=bo)
@@ -198,12 +377,6 @@ class MaterialConverter:
             self._propagate_material_settings(bm, layer)
             hsgmat.addLayer(layer.key)
 
-        # Cache this material for later
-        if bo in self._obj2mat:
-            self._obj2mat[bo].append(hsgmat.key)
-        else:
-            self._obj2mat[bo] = [hsgmat.key]
-
         # Looks like we're done...
         return hsgmat.key
 
@@ -403,9 +576,9 @@ class MaterialConverter:
         # We'll allow this, just for sanity's sake...
         pass
 
-    def export_prepared_layer(self, layer, image):
+    def export_prepared_layer(self, layer, image, mipmap=False, use_alpha=None):
         """This exports an externally prepared layer and image"""
-        key = _Texture(image=image)
+        key = _Texture(image=image, mipmap=mipmap, use_alpha=use_alpha, compress=mipmap)
         if key not in self._pending:
             print("        Stashing '{}' for conversion as '{}'".format(image.name, str(key)))
             self._pending[key] = [layer.key,]
@@ -413,83 +586,238 @@ class MaterialConverter:
             print("        Found another user of '{}'".format(image.name))
             self._pending[key].append(layer.key)
 
-    def finalize(self):
-        for key, layers in self._pending.items():
-            name = str(key)
-            print("\n[Mipmap '{}']".format(name))
-
+    def finalize(self, partial=False):
+        """Exports all of the pending textures. A partial finalize means that more pages are coming,
+           so we can't know yet whether or not a texture is shared."""
+        self._merge_duplicate_textures()
+        self._analyze_textures()
+        self._plan_texture_pages(partial)
+        sizes = self._plan_texture_sizes()
+
+        # Textures.prp only holds textures, so it can go out to the disk as soon as everything in it
+        # is converted instead of hanging around while we do the rest. So, do its textures first.
+        # If we're only seeing some of the pages, more textures for it could still show up.
+        textures_page = None if partial else self._mgr.get_page_location("Textures")
+        pending = sorted(self._pending.items(), key=lambda x: textures_page not in self._texture_pages[x[0]].values())
+        remaining = sum((1 for key, layers in pending if textures_page in self._texture_pages[key].values()))
+        for key, layers in pending:
             image = key.image
             oWidth, oHeight = image.size
-            eWidth = helpers.ensure_power_of_two(oWidth)
-            eHeight = helpers.ensure_power_of_two(oHeight)
-            if (eWidth != oWidth) or (eHeight != oHeight):
-                print("    Image is not a POT ({}x{}) resizing to {}x{}".format(oWidth, oHeight, eWidth, eHeight))
-                self._resize_image(image, eWidth, eHeight)
+            eWidth, eHeight = sizes[key]
+            name = key.get_name(eWidth, eHeight)
+            print("\n[Mipmap '{}']".format(name))
 
             # Some basic mipmap settings.
-            numLevels = math.floor(math.log(max(eWidth, eHeight), 2)) + 1 if key.mipmap else 1
-            compression = plBitmap.kDirectXCompression if key.mipmap else plBitmap.kUncompressed
-            dxt = plBitmap.kDXT5 if key.use_alpha or key.calc_alpha else plBitmap.kDXT1
-
-            # Major Workaround Ahoy
-            # There is a bug in Cyan's level size algorithm that causes it to not allocate enough memory
-            # for the color block in certain mipmaps. I personally have encountered an access violation on
-            # 1x1 DXT5 mip levels -- the code only allocates an alpha block and not a color block. Paradox
-            # reports that if any dimension is smaller than 4px in a mip level, OpenGL doesn't like Cyan generated
-            # data. So, we're going to lop off the last two mip levels, which should be 1px and 2px as the smallest.
-            # This bug is basically unfixable without crazy hacks because of the way Plasma reads in texture data.
-            #     "<Deledrius> I feel like any texture at a 1x1 level is essentially academic.  I mean, JPEG/DXT
-            #                  doesn't even compress that, and what is it?  Just the average color of the whole
-            #                  texture in a single pixel?"
-            # :)
-            if key.mipmap:
-                # If your mipmap only has 2 levels (or less), then you deserve to phail...
-                numLevels = max(numLevels - 2, 2)
-
-            # Grab the image data from OpenGL and stuff it into the plBitmap
-            with _GLTexture(image) as glimage:
-                if key.mipmap:
-                    print("    Generating mip levels")
-                    glimage.generate_mipmap()
-                else:
-                    print("    Stuffing image data")
-
-                # Uncompressed bitmaps are BGRA
-                fmt = compression == plBitmap.kUncompressed
-
-                # Hold the uncompressed level data for now. We may have to make multiple copies of
-                # this mipmap for per-page textures :(
-                data = []
-                for i in range(numLevels):
-                    data.append(glimage.get_level_data(i, key.calc_alpha, fmt))
-
-            # Be a good citizen and reset the Blender Image to pre-futzing state
-            image.reload()
-
-            # Now we poke our new bitmap into the pending layers. Note that we have to do some funny
-            # business to account for per-page textures
+            numLevels = _get_num_levels(key, eWidth, eHeight)
+            compression, dxt = _get_texture_format(key, eWidth, eHeight)
+
+            # Uncompressed bitmaps are BGRA
+            fmt = compression == plBitmap.kUncompressed
+
+            # Make the plMipmap in every page that gets this texture (either layer's page or Textures.prp)
+            # unless an earlier finalize already put it there.
             mgr = self._mgr
+            placement = self._texture_pages[key]
+            finished = self._finished.setdefault(key, {})
             pages = {}
+            for page in sorted(frozenset(placement.values()) - frozenset(finished), key=mgr.get_page_name):
+                pages[page] = plMipmap(name=name, width=eWidth, height=eHeight, numLevels=numLevels,
+                                       compType=compression, format=plBitmap.kRGB8888, dxtLevel=dxt)
+            if pages:
+                mipmaps = list(pages.values())
+                func = mipmaps[0].CompressImage if compression == plBitmap.kDirectXCompression else mipmaps[0].setLevel
+
+                # Grab the image data from OpenGL and stuff it into the plBitmap
+                # Each level is compressed into the first plMipmap as soon as we have it and the uncompressed
+                # data is thrown away. Per-page copies just get the already compressed level.
+                with _get_texture_source(image) as glimage:
+                    if (eWidth != oWidth) or (eHeight != oHeight):
+                        # Resample a copy of the pixels so the artist's image is never touched
+                        texture_filter = self._exporter()._op.texture_filter
+                        print("    Image is {}x{}, resampling to {}x{} ({})".format(oWidth, oHeight, eWidth, eHeight, texture_filter.lower()))
+                        pixels = imageproc.from_bytes(glimage.get_level_data(quiet=True), oWidth, oHeight)
+                        pixels = imageproc.resample(pixels, eWidth, eHeight, texture_filter)
+                        levels = imageproc.generate_levels(pixels, numLevels, key.calc_alpha, fmt)
+                        del pixels
+                    else:
+                        if key.mipmap:
+                            print("    Generating mip levels")
+                            glimage.generate_mipmap()
+                        else:
+                            print("    Stuffing image data")
+                        levels = (glimage.get_level_data(i, key.calc_alpha, fmt) for i in range(numLevels))
+
+                    for i, level in enumerate(levels):
+                        func(i, level)
+                        del level
+                        for copy in mipmaps[1:]:
+                            copy.setLevel(i, mipmaps[0].getLevel(i))
+
+                # Now we poke our new bitmap into the pending layers.
+                for page, mipmap in pages.items():
+                    if key.library:
+                        mgr.add_library_texture(mipmap)
+                    else:
+                        mgr.AddObject(page, mipmap)
+                    finished[page] = mipmap.key
+
+                ir = self._exporter().ir
+                if ir is not None:
+                    levels = [mipmaps[0].getLevel(i) for i in range(numLevels)]
+                    ir.add_mipmaps(mgr, mipmaps, levels, eWidth, eHeight, compression, dxt)
+            else:
+                print("    Already exported")
 
             print("    Adding to Layer(s)")
             for layer in layers:
                 print("        {}".format(layer.name))
-                page = mgr.get_textures_page(layer) # Layer's page or Textures.prp
-
-                # If we haven't created this plMipmap in the page (either layer's page or Textures.prp),
-                # then we need to do that and stuff the level data. This is a little tedious, but we
-                # need to be careful to manage our resources correctly
-                if page not in pages:
-                    mipmap = plMipmap(name=name, width=eWidth, height=eHeight, numLevels=numLevels,
-                                      compType=compression, format=plBitmap.kRGB8888, dxtLevel=dxt)
-                    func = mipmap.CompressImage if compression == plBitmap.kDirectXCompression else mipmap.setLevel
-                    for i, level in enumerate(data):
-                        func(i, level)
-                    mgr.AddObject(page, mipmap)
-                    pages[page] = mipmap
-                else:
-                    mipmap = pages[page]
-                layer.object.texture = mipmap.key
+                layer.object.texture = finished[placement[layer]]
+
+            if textures_page in placement.values():
+                remaining -= 1
+                if not remaining:
+                    print("\n[Texture Page]")
+                    self._mgr.flush_page(textures_page)
+        self._pending = {}
+
+    def _merge_duplicate_textures(self):
+        """Merges pending textures whose images have identical pixels, eg 'rock.png' and
+           'rock.png.001', so that all of their layers share one plMipmap"""
+        # Only images with the same size can be duplicates, so don't bother hashing the others
+        candidates = {}
+        for key in self._pending:
+            candidates.setdefault((tuple(key.image.size), key.calc_alpha), []).append(key)
+
+        for keys in candidates.values():
+            if len(keys) < 2:
+                continue
+            originals = {}
+            for key in sorted(keys, key=str):
+                digest = self._get_image_digest(key.image)
+                original = originals.setdefault(digest, key)
+                if original is key:
+                    continue
+                print("\n[Texture '{}' is a duplicate of '{}']".format(key.image.name, original.image.name))
+                original._update(key)
+                self._pending[original].extend(self._pending.pop(key))
+
+    def _get_image_digest(self, image):
+        with _get_texture_source(image) as glimage:
+            data = glimage.get_level_data(quiet=True)
+        return hashlib.md5(data).digest()
+
+    def _analyze_textures(self):
+        """Figures out what kind of alpha each pending texture has so we can pick the smallest
+           compressed format that doesn't mangle it"""
+        print("\n[Texture Formats]")
+        savings = 0
+        for key in sorted(self._pending, key=str):
+            if key.use_alpha and not key.calc_alpha:
+                key.alpha_type = self._get_alpha_type(key.image)
+            width, height = (helpers.ensure_power_of_two(i) for i in key.image.size)
+            compression, dxt = _get_texture_format(key, width, height)
+            naive_bytes = _estimate_texture_bytes(key, width, height, _get_naive_format(key))
+            num_bytes = _estimate_texture_bytes(key, width, height, (compression, dxt))
+            savings += naive_bytes - num_bytes
+
+            if compression == plBitmap.kUncompressed:
+                fmt = "ARGB32"
+            else:
+                fmt = "DXT5" if dxt == plBitmap.kDXT5 else "DXT1"
+            print("    {}: {} (alpha: {}, saved {} bytes)".format(key, fmt, _get_alpha_type(key).lower(), naive_bytes - num_bytes))
+        print("    Total saved: {} bytes".format(savings))
+
+    def _plan_texture_pages(self, partial=False):
+        """Decides which page(s) each pending texture is exported to. Textures used by only one page
+           go into that page, and shared textures go into Textures.prp (if there is one) so that
+           what's in memory follows what's actually paged in. If we're only seeing some of the pages,
+           every texture is treated as shared."""
+        print("\n[Texture Placement]")
+        mgr = self._mgr
+        self._texture_pages = {}
+        for key in sorted(self._pending, key=str):
+            layers = self._pending[key]
+            library = mgr.get_texture_library() if key.library else None
+            if key.library and library is None:
+                self._exporter().report.warn("'{}' wants to be in the texture library, but there's no library to export it to".format(key), indent=1)
+                key.library = False
+            if library is not None:
+                placement = {layer: library for layer in layers}
+            else:
+                users = None if partial else frozenset((layer.location for layer in layers))
+                placement = {layer: mgr.get_textures_page(layer, users) for layer in layers}
+            self._texture_pages[key] = placement
+
+            page_names = sorted((mgr.get_page_name(i) for i in frozenset(placement.values())))
+            print("    {}: {}".format(key, ", ".join(page_names)))
+
+    def _plan_texture_sizes(self):
+        """Picks the exported size of every pending texture, downscaling the least important ones
+           until everything fits into the page and age texture memory budgets"""
+        mgr = self._mgr
+        sizes, pages = {}, {}
+        for key, layers in self._pending.items():
+            width, height = (helpers.ensure_power_of_two(i) for i in key.image.size)
+            while key.max_size and max(width, height) > key.max_size:
+                width, height = max(width // 2, 1), max(height // 2, 1)
+            sizes[key] = (width, height)
+            pages[key] = frozenset(self._texture_pages[key].values())
+
+        # Page budgets go first, so the age budget sees what's left after they've been applied
+        age = bpy.context.scene.world.plasma_age
+        budgets = []
+        for page in age.pages:
+            location = mgr.get_page_location(page.name)
+            if location is not None and page.texture_budget:
+                budgets.append((page.name, location, int(page.texture_budget * _MiB)))
+        if age.texture_budget:
+            budgets.append((self._exporter().age_name, None, int(age.texture_budget * _MiB)))
+
+        def get_bytes(key):
+            return _estimate_texture_bytes(key, *sizes[key])
+
+        for name, location, budget in budgets:
+            # Textures are copied into each page that uses them, so they count against the age once per page
+            if location is None:
+                users = {key: len(key_pages) for key, key_pages in pages.items()}
+            else:
+                users = {key: 1 for key, key_pages in pages.items() if location in key_pages}
+            total = sum((get_bytes(key) * count for key, count in users.items()))
+            while total > budget:
+                candidates = [key for key in users if max(sizes[key]) > _MIN_BUDGET_TEXTURE_SIZE]
+                if not candidates:
+                    self._exporter().report.warn("Textures in '{}' use {} bytes, which is more than the budget of {} bytes".format(name, total, budget))
+                    break
+                key = min(candidates, key=lambda x: (x.priority, -get_bytes(x), str(x)))
+                total -= get_bytes(key) * users[key]
+                width, height = sizes[key]
+                sizes[key] = (max(width // 2, 1), max(height // 2, 1))
+                total += get_bytes(key) * users[key]
+
+        print("\n[Texture Budget]")
+        total = 0
+        for key in sorted(sizes, key=str):
+            num_bytes = get_bytes(key) * len(pages[key])
+            total += num_bytes
+            print("    {}: {}x{} ({} bytes)".format(key, sizes[key][0], sizes[key][1], num_bytes))
+        print("    Total: {} bytes".format(total))
+        return sizes
+
+    def _get_material_cache_key(self, bo, bm):
+        """Figures out which objects are able to share an exported material"""
+        # Lightmaps are piggybacked onto the object's materials, and DynamicCamMaps target the
+        # object itself, so these objects get their very own hsGMaterials.
+        unique = bo.plasma_modifiers.lightmap.enabled
+        if not unique:
+            for slot in bm.texture_slots:
+                if slot is not None and slot.use and slot.texture is not None:
+                    if slot.texture.type == "ENVIRONMENT_MAP":
+                        unique = True
+                        break
+
+        # The UVW channel of each layer is looked up by UV texture name on the object's mesh
+        uvtexs = tuple((i.name for i in bo.data.tessface_uv_textures))
+        return (bm, self._mgr.get_location(bo), uvtexs, bo if unique else None)
 
     def get_materials(self, bo):
         return self._obj2mat[bo]
@@ -513,16 +841,8 @@ class MaterialConverter:
         layer.runtime = utils.color(bm.diffuse_color)
         layer.specular = utils.color(bm.specular_color)
 
-    def _resize_image(self, image, width, height):
-        image.scale(width, height)
-
-        # If the image is already loaded into OpenGL, we need to refresh it to get the scaling.
-        if image.bindcode != 0:
-            image.gl_free()
-            image.gl_load()
-
-    def _test_image_alpha(self, image):
-        """Tests to see if this image has any alpha data"""
+    def _get_alpha_type(self, image):
+        """Classifies the alpha data of an image as 'NONE', 'BINARY', or 'FULL'"""
 
         # In the interest of speed, let's see if we've already done this one...
         result = self._alphatest.get(image, None)
@@ -530,19 +850,17 @@ class MaterialConverter:
             return result
 
         if image.channels != 4:
-            result = False
+            result = "NONE"
         elif not image.use_alpha:
-            result = False
+            result = "NONE"
         else:
-            # Using bpy.types.Image.pixels is VERY VERY VERY slow...
-            with _GLTexture(image) as glimage:
+            with _get_texture_source(image) as glimage:
                 data = glimage.get_level_data(quiet=True)
-                for i in range(3, len(data), 4):
-                    if data[i] != 255:
-                        result = True
-                        break
-                else:
-                    result = False
+            result = imageproc.classify_alpha(imageproc.from_bytes(data, *image.size))
 
         self._alphatest[image] = result
         return result
+
+    def _test_image_alpha(self, image):
+        """Tests to see if this image has any alpha data"""
+        return self._get_alpha_type(image) != "NONE"
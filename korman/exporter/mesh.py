@@ -14,19 +14,38 @@
 #    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
 
 import bpy
+import concurrent.futures
+import math
+import numpy
+import os
 from PyHSPlasma import *
 import weakref
 
+from . import bakefarm
 from . import explosions
+from .geometry import build_geometry
 from .. import helpers
+from ..properties.modifiers.render import LIGHTMAP_MIN_SIZE
 from . import material
 from . import utils
+from . import vertexlight
 
 _MAX_VERTS_PER_SPAN = 0xFFFF
 _WARN_VERTS_PER_SPAN = 0x8000
 
 _VERTEX_COLOR_LAYERS = {"col", "color", "colour"}
 
+def _lightmap_bytes(size, compressed):
+    """Estimates the exported size of a lightmap, including its mip levels"""
+    if not compressed:
+        return size * size * 4
+    # DXT1 is 4bpp, and the exporter drops the two smallest mip levels
+    num_bytes, num_levels = 0, max(int(math.log(size, 2)) - 1, 2)
+    for i in range(num_levels):
+        level = max(size >> i, 4)
+        num_bytes += level * level // 2
+    return num_bytes
+
 class _RenderLevel:
     MAJOR_OPAQUE = 0
     MAJOR_FRAMEBUF = 1
@@ -97,11 +116,61 @@ class _DrawableCriteria:
             return "Spans"
 
 
-class _GeoData:
-    def __init__(self, numVtxs):
-        self.blender2gs = [{} for i in range(numVtxs)]
-        self.triangles = []
-        self.vertices = []
+def _foreach_get(seq, attr, count, dtype, size=1):
+    buf = numpy.empty(count * size, dtype=dtype)
+    seq.foreach_get(attr, buf)
+    if size == 1:
+        return buf
+    return buf.reshape((count, size))
+
+
+class _GeometrySnapshot:
+    """A plain copy of the Blender mesh data needed to build an object's geometry. This is gathered
+       on the main thread, but it pickles, so the conversion can be done anywhere."""
+
+    def __init__(self, bo, mesh):
+        num_verts, num_faces = len(mesh.vertices), len(mesh.tessfaces)
+        self.name = mesh.name
+        self.slots = [i for i, bm in enumerate(mesh.materials) if bm is not None]
+        self.positions = _foreach_get(mesh.vertices, "co", num_verts, numpy.float32, 3)
+        self.normals = _foreach_get(mesh.vertices, "normal", num_verts, numpy.float32, 3)
+        self.faces = _foreach_get(mesh.tessfaces, "vertices_raw", num_faces, numpy.int32, 4)
+        self.face_materials = _foreach_get(mesh.tessfaces, "material_index", num_faces, numpy.int32)
+
+        # Unpack the UV coordinates from each UV Texture layer
+        # NOTE: Blender has no third (W) coordinate
+        uvs = [_foreach_get(uvtex.data, "uv_raw", num_faces, numpy.float32, 8).reshape((num_faces, 4, 1, 2))
+               for uvtex in mesh.tessface_uv_textures]
+        if uvs:
+            self.uvs = numpy.concatenate(uvs, axis=2)
+        else:
+            self.uvs = numpy.zeros((num_faces, 4, 0, 2), dtype=numpy.float32)
+
+        # Locate relevant vertex color layers now...
+        color, alpha = None, None
+        for vcol_layer in mesh.tessface_vertex_colors:
+            name = vcol_layer.name.lower()
+            if name in _VERTEX_COLOR_LAYERS:
+                color = vcol_layer.data
+            elif name == "autocolor" and color is None and not bo.plasma_modifiers.lightmap.enabled:
+                color = vcol_layer.data
+            elif name == "alpha":
+                alpha = vcol_layer.data
+
+        # Colors are stored per face corner, just like the UVs
+        if color is None:
+            self.colors = numpy.ones((num_faces, 4, 3), dtype=numpy.float32)
+        else:
+            self.colors = self._get_corner_colors(color, num_faces)
+        if alpha is None:
+            self.alphas = numpy.ones((num_faces, 4), dtype=numpy.float32)
+        else:
+            # average color becomes the alpha value
+            self.alphas = self._get_corner_colors(alpha, num_faces).sum(axis=2) / 3
+
+    def _get_corner_colors(self, data, num_faces):
+        corners = [_foreach_get(data, "color{}".format(i), num_faces, numpy.float32, 3) for i in range(1, 5)]
+        return numpy.concatenate([i[:, numpy.newaxis] for i in corners], axis=1)
 
 
 class MeshConverter:
@@ -110,16 +179,18 @@ class MeshConverter:
         self.material = material.MaterialConverter(exporter)
 
         self._dspans = {}
+        self._geometry = {}
         self._mesh_geospans = {}
+        self._snapshots = {}
 
-    def _create_geospan(self, bo, mesh, bm, hsgmatKey):
+    def _create_geospan(self, bo, snapshot, bm, hsgmatKey):
         """Initializes a plGeometrySpan from a Blender Object and an hsGMaterial"""
         geospan = plGeometrySpan()
         geospan.material = hsgmatKey
 
         # GeometrySpan format
         # For now, we really only care about the number of UVW Channels
-        numUVWchans = len(mesh.tessface_uv_textures)
+        numUVWchans = snapshot.uvs.shape[2]
         if numUVWchans > plGeometrySpan.kUVCountMask:
             raise explosions.TooManyUVChannelsError(bo, bm)
         geospan.format = numUVWchans
@@ -140,11 +211,19 @@ class MeshConverter:
             geospan.worldToLocal = geospan.localToWorld.inverse()
         return geospan
 
-    def finalize(self):
-        """Prepares all baked Plasma geometry to be flushed to the disk"""
+    def finalize(self, location=None):
+        """Prepares all baked Plasma geometry (or just that of one page) to be flushed to the disk"""
+
+        # Geometry that nobody asked for (eg objects that share another object's mesh) is garbage now
+        for future in self._geometry.values():
+            future.cancel()
+        self._geometry.clear()
+        self._snapshots.clear()
 
-        for loc in self._dspans.values():
-            for dspan in loc.values():
+        for loc, dspans in self._dspans.items():
+            if location is not None and loc != location:
+                continue
+            for dspan in dspans.values():
                 print("\n[DrawableSpans '{}']".format(dspan.key.name))
                 print("    Composing geometry data")
 
@@ -159,170 +238,221 @@ class MeshConverter:
                 # at home (and actually enjoys reading these lawgs)
                 print("    Bounds and SpaceTree in the saddle")
 
-    def _export_geometry(self, bo, mesh, geospans):
-        geodata = [_GeoData(len(mesh.vertices)) for i in mesh.materials]
-
-        # Locate relevant vertex color layers now...
-        color, alpha = None, None
-        for vcol_layer in mesh.tessface_vertex_colors:
-            name = vcol_layer.name.lower()
-            if name in _VERTEX_COLOR_LAYERS:
-                color = vcol_layer.data
-            elif name == "autocolor" and color is None and not bo.plasma_modifiers.lightmap.enabled:
-                color = vcol_layer.data
-            elif name == "alpha":
-                alpha = vcol_layer.data
-
-        # Convert Blender faces into things we can stuff into libHSPlasma
-        for i, tessface in enumerate(mesh.tessfaces):
-            data = geodata[tessface.material_index]
-            face_verts = []
-
-            # Unpack the UV coordinates from each UV Texture layer
-            # NOTE: Blender has no third (W) coordinate
-            tessface_uvws = [uvtex.data[i].uv for uvtex in mesh.tessface_uv_textures]
-
-            # Unpack colors
-            if color is None:
-                tessface_colors = ((1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, 1.0))
-            else:
-                src = color[i]
-                tessface_colors = (src.color1, src.color2, src.color3, src.color4)
-
-            # Unpack alpha values
-            if alpha is None:
-                tessface_alphas = (1.0, 1.0, 1.0, 1.0)
-            else:
-                src = alpha[i]
-                # average color becomes the alpha value
-                tessface_alphas = (((src.color1[0] + src.color1[1] + src.color1[2]) / 3),
-                                   ((src.color2[0] + src.color2[1] + src.color2[2]) / 3),
-                                   ((src.color3[0] + src.color3[1] + src.color3[2]) / 3),
-                                   ((src.color4[0] + src.color4[1] + src.color4[2]) / 3))
-
-            # Convert to per-material indices
-            for j, vertex in enumerate(tessface.vertices):
-                uvws = tuple([uvw[j] for uvw in tessface_uvws])
-
-                # Grab VCols
-                vertex_color = (int(tessface_colors[j][0] * 255), int(tessface_colors[j][1] * 255),
-                                int(tessface_colors[j][2] * 255), int(tessface_alphas[j] * 255))
-
-                # Now, we'll index into the vertex dict using the per-face elements :(
-                # We're using tuples because lists are not hashable. The many mathutils and PyHSPlasma
-                # types are not either, and it's entirely too much work to fool with all that.
-                coluv = (vertex_color, uvws)
-                if coluv not in data.blender2gs[vertex]:
-                    source = mesh.vertices[vertex]
-                    geoVertex = plGeometrySpan.TempVertex()
-                    geoVertex.position = utils.vector3(source.co)
-                    geoVertex.normal = utils.vector3(source.normal)
-                    geoVertex.color = hsColor32(*vertex_color)
-                    geoVertex.uvs = [hsVector3(uv[0], uv[1], 0.0) for uv in uvws]
-                    data.blender2gs[vertex][coluv] = len(data.vertices)
-                    data.vertices.append(geoVertex)
-                face_verts.append(data.blender2gs[vertex][coluv])
-
-            # Convert to triangles, if need be...
-            if len(face_verts) == 3:
-                data.triangles += face_verts
-            elif len(face_verts) == 4:
-                data.triangles += (face_verts[0], face_verts[1], face_verts[2])
-                data.triangles += (face_verts[0], face_verts[2], face_verts[3])
-
-        # Time to finish it up...
-        for i, data in enumerate(geodata):
-            geospan = geospans[i][0]
-            numVerts = len(data.vertices)
+    def _export_geometry(self, snapshot, geometry, geospans):
+        for data, (geospan, pass_index) in zip(geometry, geospans):
+            if data is None:
+                geospan.indices = []
+                geospan.vertices = []
+                continue
+            numVerts = len(data["positions"])
 
             # Soft vertex limit at 0x8000 for PotS and below. Works fine as long as it's a uint16
             # MOUL only allows signed int16s, however :/
             if numVerts > _MAX_VERTS_PER_SPAN or (numVerts > _WARN_VERTS_PER_SPAN and self._mgr.getVer() >= pvMoul):
-                raise explosions.TooManyVerticesError(mesh.name, geospan.material.name, numVerts)
+                raise explosions.TooManyVerticesError(snapshot.name, geospan.material.name, numVerts)
             elif numVerts > _WARN_VERTS_PER_SPAN:
                 pass # FIXME
 
             # If we're still here, let's add our data to the GeometrySpan
-            geospan.indices = data.triangles
-            geospan.vertices = data.vertices
+            vertices = []
+            for position, normal, color, uvs in zip(data["positions"].tolist(), data["normals"].tolist(),
+                                                    data["colors"].tolist(), data["uvs"].tolist()):
+                geoVertex = plGeometrySpan.TempVertex()
+                geoVertex.position = hsVector3(*position)
+                geoVertex.normal = hsVector3(*normal)
+                geoVertex.color = hsColor32(*color)
+                geoVertex.uvs = [hsVector3(uv[0], uv[1], 0.0) for uv in uvs]
+                vertices.append(geoVertex)
+            geospan.indices = data["indices"].tolist()
+            geospan.vertices = vertices
+
+    def prepare_geometry(self, objects):
+        """Snapshots the mesh data of all of the given objects on the main thread, then converts
+           the snapshots into vertex and index buffers in a worker pool"""
+        batch = {}
+        for bo in objects:
+            if bo.type != "MESH" or not bo.data.materials:
+                continue
+
+            # Step 0.8: Update the mesh such that we can do things and schtuff...
+            mesh = bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=True)
+            with helpers.TemporaryObject(mesh, bpy.data.meshes.remove):
+                # Step 0.9: Figure out which materials are attached to this object. Because Blender is backwards,
+                #           we can actually have materials that are None. gotdawgit!!!
+                materials = [i for i in mesh.materials if i is not None]
+                if materials:
+                    batch[bo] = (_GeometrySnapshot(bo, mesh), materials)
+
+        if not batch:
+            return
+        print("\n[Geometry]")
+        print("    Building geometry for {} object(s)...".format(len(batch)))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+        for bo, (snapshot, materials) in batch.items():
+            self._geometry[bo] = executor.submit(build_geometry, snapshot)
+        executor.shutdown(wait=False)
+        self._snapshots.update(batch)
 
     def export_object(self, bo):
         # If this object has modifiers, then it's a unique mesh, and we don't need to try caching it
         # Otherwise, let's *try* to share meshes as best we can...
+        drawables = None
         if not bo.modifiers:
             drawables = self._mesh_geospans.get(bo.data, None)
-            if drawables is None:
-                drawables = self._export_mesh(bo)
+        if drawables is None:
+            drawables = self._export_mesh(bo)
 
         # Create the DrawInterface
         if drawables:
             diface = self._mgr.add_object(pl=plDrawInterface, bl=bo)
             for dspan_key, idx in drawables:
                 diface.addDrawable(dspan_key, idx)
+            ir = self._exporter().ir
+            if ir is not None:
+                ir.add_drawables(self._mgr, diface, drawables)
 
     def _export_mesh(self, bo):
-        # Step 0.7: Update the mesh such that we can do things and schtuff...
-        mesh = bo.to_mesh(bpy.context.scene, True, "RENDER", calc_tessface=True)
-
-        # Step 0.8: Figure out which materials are attached to this object. Because Blender is backwards,
-        #           we can actually have materials that are None. gotdawgit!!!
-        materials = [i for i in mesh.materials if i is not None]
-        if not materials:
+        # NOTE: static lighting was already generated by bake_static_lighting(), and the geometry
+        #       snapshot was taken by prepare_geometry()
+        if bo not in self._snapshots:
             return None
-
-        # Step 0.9: If this mesh wants to be lit, we need to go ahead and generate it.
-        self._export_static_lighting(bo)
-
-        with helpers.TemporaryObject(mesh, bpy.data.meshes.remove):
-            # Step 1: Export all of the doggone materials.
-            geospans = self._export_material_spans(bo, mesh, materials)
-
-            # Step 2: Export Blender mesh data to Plasma GeometrySpans
-            self._export_geometry(bo, mesh, geospans)
-
-            # Step 3: Add plGeometrySpans to the appropriate DSpan and create indices
-            _diindices = {}
-            for geospan, pass_index in geospans:
-                dspan = self._find_create_dspan(bo, geospan.material.object, pass_index)
-                print("    Exported hsGMaterial '{}' geometry into '{}'".format(geospan.material.name, dspan.key.name))
-                idx = dspan.addSourceSpan(geospan)
-                if dspan not in _diindices:
-                    _diindices[dspan] = [idx,]
-                else:
-                    _diindices[dspan].append(idx)
-
-            # Step 3.1: Harvest Span indices and create the DIIndices
-            drawables = []
-            for dspan, indices in _diindices.items():
-                dii = plDISpanIndex()
-                dii.indices = indices
-                idx = dspan.addDIIndex(dii)
-                drawables.append((dspan.key, idx))
-            return drawables
-
-    def _export_material_spans(self, bo, mesh, materials):
+        snapshot, materials = self._snapshots.pop(bo)
+
+        # Step 1: Export all of the doggone materials.
+        geospans = self._export_material_spans(bo, snapshot, materials)
+
+        # Step 2: Export Blender mesh data to Plasma GeometrySpans
+        #         The workers hand back their results in the order we ask for them, so the merge is
+        #         always the same no matter who finishes first.
+        geometry = self._geometry.pop(bo).result()
+        self._export_geometry(snapshot, geometry, geospans)
+
+        # Step 3: Add plGeometrySpans to the appropriate DSpan and create indices
+        ir = self._exporter().ir
+        _diindices = {}
+        for data, (geospan, pass_index) in zip(geometry, geospans):
+            dspan = self._find_create_dspan(bo, geospan.material.object, pass_index)
+            print("    Exported hsGMaterial '{}' geometry into '{}'".format(geospan.material.name, dspan.key.name))
+            idx = dspan.addSourceSpan(geospan)
+            if ir is not None:
+                ir.add_span(self._mgr, dspan, idx, geospan, data)
+            if dspan not in _diindices:
+                _diindices[dspan] = [idx,]
+            else:
+                _diindices[dspan].append(idx)
+
+        # Step 3.1: Harvest Span indices and create the DIIndices
+        drawables = []
+        for dspan, indices in _diindices.items():
+            dii = plDISpanIndex()
+            dii.indices = indices
+            idx = dspan.addDIIndex(dii)
+            drawables.append((dspan.key, idx))
+            if ir is not None:
+                ir.add_di_index(self._mgr, dspan, idx, indices)
+        return drawables
+
+    def _export_material_spans(self, bo, snapshot, materials):
         """Exports all Materials and creates plGeometrySpans"""
         geospans = [None] * len(materials)
         for i, blmat in enumerate(materials):
             matKey = self.material.export_material(bo, blmat)
-            geospans[i] = (self._create_geospan(bo, mesh, blmat, matKey), blmat.pass_index)
+            geospans[i] = (self._create_geospan(bo, snapshot, blmat, matKey), blmat.pass_index)
         return geospans
 
-    def _export_static_lighting(self, bo):
-        helpers.make_active_selection(bo)
-        lm = bo.plasma_modifiers.lightmap
-        if lm.enabled:
-            print("    Baking lightmap...")
-            bpy.ops.object.plasma_lightmap_autobake(light_group=lm.light_group)
-        else:
-            for vcol_layer in bo.data.vertex_colors:
-                name = vcol_layer.name.lower()
-                if name in _VERTEX_COLOR_LAYERS:
+    def _assign_lightmap_resolutions(self, lightmaps, reset=False):
+        """Picks the resolution for all automatic lightmaps, shrinking the biggest ones until
+           they fit into the age's lightmap memory budget. The resolutions only hold for this
+           export, so they are reset once the lightmaps are baked."""
+        if reset:
+            for group in lightmaps.values():
+                for bo in group:
+                    bo.plasma_modifiers.lightmap.auto_resolution = 0
+            return
+
+        age = bpy.context.scene.world.plasma_age
+        auto = {}
+        for group in lightmaps.values():
+            for bo in group:
+                lm = bo.plasma_modifiers.lightmap
+                if lm.quality == "AUTO":
+                    auto[bo] = lm.calc_auto_resolution(bo, age.lightmap_density)
+
+        budget = int(age.lightmap_budget * 1024 * 1024)
+        if budget and auto:
+            total = sum((_lightmap_bytes(size, bo.plasma_modifiers.lightmap.use_compression)
+                         for bo, size in auto.items()))
+            while total > budget:
+                bo, size = max(auto.items(), key=lambda x: x[1])
+                if size <= LIGHTMAP_MIN_SIZE:
+                    self._exporter().report.warn("Automatic lightmaps use {} bytes, which is more than the budget of {} bytes".format(total, budget))
                     break
+                compressed = bo.plasma_modifiers.lightmap.use_compression
+                total -= _lightmap_bytes(size, compressed) - _lightmap_bytes(size // 2, compressed)
+                auto[bo] = size // 2
+
+        print("\n[Lightmap Resolution]")
+        total = 0
+        for group in lightmaps.values():
+            for bo in group:
+                lm = bo.plasma_modifiers.lightmap
+                if bo in auto:
+                    lm.auto_resolution = auto[bo]
+                size = lm.resolution
+                num_bytes = _lightmap_bytes(size, lm.use_compression)
+                total += num_bytes
+                print("    {}: {}x{} ({}{} bytes)".format(bo.name, size, size, "auto, " if bo in auto else "", num_bytes))
+        print("    Total: {} bytes".format(total))
+
+    def bake_static_lighting(self, objects):
+        """Generates the static lighting for all of the given objects before any geometry is
+           exported. Objects are baked in groups to avoid paying the setup cost per object."""
+        lightmaps = {}
+        vertex_lit = []
+        for bo in objects:
+            if bo.type != "MESH" or not bo.data.materials:
+                continue
+
+            lm = bo.plasma_modifiers.lightmap
+            if lm.enabled:
+                # All lightmaps using the same light group can be baked at the same time
+                lightmaps.setdefault(lm.light_group, []).append(bo)
             else:
-                print("    Baking crappy vertex color lighting...")
-                bpy.ops.object.plasma_vertexlight_autobake()
-
+                for vcol_layer in bo.data.vertex_colors:
+                    name = vcol_layer.name.lower()
+                    if name in _VERTEX_COLOR_LAYERS:
+                        break
+                else:
+                    vertex_lit.append(bo)
+
+        if vertex_lit:
+            print("\n[Vertex Lighting]")
+            print("    Calculating vertex color lighting for {} object(s)...".format(len(vertex_lit)))
+            lighter = vertexlight.VertexLighter(bpy.context.scene)
+            lighter.light(vertex_lit)
+
+        # NOTE: Blender Internal only bakes the selected objects, so we can't get away from touching
+        #       the selection entirely for lightmaps.
+        if not lightmaps:
+            return
+        self._assign_lightmap_resolutions(lightmaps)
+        try:
+            exporter = self._exporter()
+            selection = exporter.selection
+            if exporter._op.lightmap_workers:
+                print("\n[Lightmap Bake Farm]")
+                farm = bakefarm.LightmapBakeFarm(exporter._op.lightmap_workers)
+                farm.bake(lightmaps, selection)
+                return
+
+            for light_group, group in lightmaps.items():
+                print("\n[Lightmap Bake '{}']".format(light_group if light_group else "<auto>"))
+                for bo in group:
+                    print("    {}".format(bo.name))
+                selection.select(group, group[0])
+                bpy.ops.object.plasma_lightmap_autobake(light_group=light_group, batch=True)
+        finally:
+            self._assign_lightmap_resolutions(lightmaps, reset=True)
 
     def _find_create_dspan(self, bo, hsgmat, pass_index):
         location = self._mgr.get_location(bo)
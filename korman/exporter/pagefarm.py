@@ -0,0 +1,132 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import traceback
+
+from . import bakefarm
+from . import explosions
+
+# The name of our addon module, which the workers need to enable
+_ADDON = __name__.split(".")[0]
+
+def _log_name(job):
+    # The worker's ExportLogger names the log after the job file
+    return "{}_export.log".format(os.path.splitext(job)[0])
+
+
+class _WorkerOperator:
+    """Stands in for the export operator in a worker. The export settings live on the age, so the
+       worker's snapshot of the blend file already has the same settings as the parent."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def __getattr__(self, attr):
+        return getattr(bpy.context.scene.world.plasma_age, attr)
+
+
+class PageExportFarm:
+    """Exports the pages of an age in parallel. Each worker process converts a group of pages from a
+       snapshot of the blend file and writes their PRPs to a scratch directory. The PRPs are only
+       moved into place once every worker has succeeded, so stale files from an earlier export
+       can't stand in for a page that a worker never wrote. Everything else (the .age, .fni, .sum,
+       and BuiltIn pages) is left for the parent to write."""
+
+    def __init__(self, num_workers, launcher=None):
+        self._num_workers = max(1, num_workers)
+        self._launcher = launcher if launcher is not None else bakefarm.BlenderWorkerLauncher(module=__name__)
+
+    def export(self, exporter, objects):
+        """Exports the pages containing the given objects in worker processes"""
+        mgr = exporter.mgr
+        pages = {}
+        for bo in objects:
+            name = mgr.get_page_name(mgr.get_location(bo))
+            pages[name] = pages.get(name, 0) + 1
+        if not pages:
+            return
+
+        tempdir = tempfile.mkdtemp(prefix="korman_export")
+        try:
+            # Step 1: Snapshot the blend file for the workers
+            snapshot = os.path.join(tempdir, "snapshot.blend")
+            bpy.ops.wm.save_as_mainfile(filepath=snapshot, copy=True, check_existing=False)
+
+            # Step 2: Hand out the pages. The workers export into the scratch directory.
+            filepath = os.path.join(tempdir, os.path.basename(exporter._op.filepath))
+            jobs = []
+            for i, shard in enumerate(self._shard(pages)):
+                job = os.path.join(tempdir, "job{}.json".format(i))
+                with open(job, "w") as handle:
+                    json.dump({"filepath": filepath, "pages": shard}, handle)
+                jobs.append(job)
+
+            # Step 3: Export!
+            print("    Exporting {} page(s) in {} worker(s)...".format(len(pages), len(jobs)))
+            results = self._launcher.run(snapshot, jobs)
+
+            # Step 4: Fold the worker logs into ours so there's only one log to read
+            for job in jobs:
+                log = _log_name(job)
+                if os.path.isfile(log):
+                    with open(log, "r") as handle:
+                        print(handle.read())
+
+            failed = sum((1 for i in results if i != 0))
+            if failed:
+                raise explosions.ExportError("{} page export worker(s) failed".format(failed))
+
+            # Step 5: Move the finished pages into place and let the manager know about them
+            for name in pages:
+                mgr.add_external_page(mgr.get_page_location(name), tempdir)
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    def _shard(self, pages):
+        """Splits the pages into one list of page names per worker, handing the biggest pages out
+           first so the workers finish at about the same time"""
+        shards = [[] for i in range(min(self._num_workers, len(pages)))]
+        loads = [0] * len(shards)
+        for name, count in sorted(pages.items(), key=lambda x: x[1], reverse=True):
+            idx = loads.index(min(loads))
+            loads[idx] += count
+            shards[idx].append(name)
+        return shards
+
+
+def worker_main():
+    """Entry point for a background Blender page export worker"""
+    job_path = sys.argv[sys.argv.index("--") + 1]
+    with open(job_path, "r") as handle:
+        job = json.load(handle)
+
+    import addon_utils
+    addon_utils.enable(_ADDON, default_set=False)
+
+    from . import convert
+    e = convert.Exporter(_WorkerOperator(job["filepath"]), pages=job["pages"], log=job_path)
+    try:
+        e.run()
+    except Exception:
+        # Blender exits cleanly after an uncaught exception in --python-expr, so make sure the
+        # parent knows this worker failed.
+        traceback.print_exc()
+        sys.exit(1)
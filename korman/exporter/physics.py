@@ -61,9 +61,16 @@ class PhysicsConverter:
                     elif len(v) == 4:
                         indices += (v[0], v[1], v[2],)
                         indices += (v[0], v[2], v[3],)
-                return (vertices, indices)
             else:
-                return vertices
+                indices = None
+
+        ir = self._exporter().ir
+        if ir is not None:
+            ir.add_physical_mesh(physical, vertices, indices)
+        if indices is not None:
+            return (vertices, indices)
+        else:
+            return vertices
 
     def generate_physical(self, bo, so, bounds, name=None):
         """Generates a physical object for the given object pair"""
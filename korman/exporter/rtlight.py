@@ -13,6 +13,8 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
 
+import math
+import mathutils
 from PyHSPlasma import *
 import weakref
 
@@ -25,9 +27,37 @@ _BL2PL = {
     "SUN": plDirectionalLightInfo,
 }
 
+def get_attenuation(bl):
+    """Returns the Plasma attenuation (constant, linear, quadratic, cutoff) of a Blender Lamp"""
+    # So sue me, this was taken from pyprp2...
+    dist = bl.distance
+    if bl.falloff_type == "LINEAR_QUADRATIC_WEIGHTED":
+        atten = (1.0, bl.linear_attenuation / dist, bl.quadratic_attenuation / dist)
+    elif bl.falloff_type == "CONSTANT":
+        atten = (1.0, 0.0, 0.0)
+    elif bl.falloff_type == "INVERSE_SQUARE":
+        atten = (1.0, 0.0, bl.quadratic_attenuation / dist)
+    elif bl.falloff_type == "INVERSE_LINEAR":
+        atten = (1.0, bl.quadratic_attenuation / dist, 0.0)
+    else:
+        raise BlenderOptionNotSupportedError(bl.falloff_type)
+
+    cutoff = dist if bl.use_sphere else dist * 2
+    return atten + (cutoff,)
+
+def get_light_color(bl):
+    """Returns the Plasma light color (sans alpha) of a Blender Lamp"""
+    energy = bl.energy * 2
+    if bl.use_negative:
+        return [(0.0 - i) * energy for i in bl.color]
+    else:
+        return [i * energy for i in bl.color]
+
+
 class LightConverter:
     def __init__(self, exporter):
         self._exporter = weakref.ref(exporter)
+        self._bounds = {}
         self._converter_funcs = {
             "POINT": self._convert_point_lamp,
             "SPOT": self._convert_spot_lamp,
@@ -54,37 +84,18 @@ class LightConverter:
         else:
             pl.falloff = 1.0
 
-    def _convert_shared_pointspot(self, bl, pl):
-        # So sue me, this was taken from pyprp2...
-        dist = bl.distance
-        if bl.falloff_type == "LINEAR_QUADRATIC_WEIGHTED":
-            print("        Attenuation: Linear Quadratic Weighted")
-            pl.attenQuadratic = bl.quadratic_attenuation / dist
-            pl.attenLinear = bl.linear_attenuation / dist
-            pl.attenConst = 1.0
-        elif bl.falloff_type == "CONSTANT":
-            print("        Attenuation: Konstant")
-            pl.attenQuadratic = 0.0
-            pl.attenLinear = 0.0
-            pl.attenConst = 1.0
-        elif bl.falloff_type == "INVERSE_SQUARE":
-            print("        Attenuation: Inverse Square")
-            pl.attenQuadratic = bl.quadratic_attenuation / dist
-            pl.attenLinear = 0.0
-            pl.attenConst = 1.0
-        elif bl.falloff_type == "INVERSE_LINEAR":
-            print("        Attenuation: Inverse Linear")
-            pl.attenQuadratic = 0.0
-            pl.attenLinear = bl.quadratic_attenuation / dist
-            pl.attenConst = 1.0
-        else:
-            raise BlenderOptionNotSupportedError(bl.falloff_type)
+    _falloff_names = {
+        "LINEAR_QUADRATIC_WEIGHTED": "Linear Quadratic Weighted",
+        "CONSTANT": "Konstant",
+        "INVERSE_SQUARE": "Inverse Square",
+        "INVERSE_LINEAR": "Inverse Linear",
+    }
 
+    def _convert_shared_pointspot(self, bl, pl):
+        pl.attenConst, pl.attenLinear, pl.attenQuadratic, pl.attenCutoff = get_attenuation(bl)
+        print("        Attenuation: {}".format(self._falloff_names[bl.falloff_type]))
         if bl.use_sphere:
-            print("        Sphere Cutoff: {}".format(dist))
-            pl.attenCutoff = dist
-        else:
-            pl.attenCutoff = dist * 2
+            print("        Sphere Cutoff: {}".format(pl.attenCutoff))
 
     def _convert_sun_lamp(self, bl, pl):
         print("    [DirectionalLightInfo '{}']".format(bl.name))
@@ -104,11 +115,7 @@ class LightConverter:
         self._converter_funcs[bl_light.type](bl_light, pl_light)
 
         # Light color nonsense
-        energy = bl_light.energy * 2
-        if bl_light.use_negative:
-            color = [(0.0 - i) * energy for i in bl_light.color]
-        else:
-            color = [i * energy for i in bl_light.color]
+        color = get_light_color(bl_light)
         color_str = "({:.4f}, {:.4f}, {:.4f})".format(color[0], color[1], color[2])
         color.append(1.0)
 
@@ -147,6 +154,13 @@ class LightConverter:
         permaLights = []
         permaProjs = []
 
+        # If this object can move, we have no idea where it will be relative to the lamps, so we
+        # can only cull lamps if it is static.
+        if self.mgr.has_coordiface(bo):
+            bounds = None
+        else:
+            bounds = self._get_world_bounds(bo)
+
         # We're going to inspect the material's light group.
         # If there is no light group, we'll say that there is no runtime lighting...
         # If there is, we will harvest all Blender lamps in that light group that are Plasma Objects
@@ -175,18 +189,92 @@ class LightConverter:
                         print("        [{}] '{}': not in same layer, skipping...".format(lamp.type, obj.name))
                         continue
 
+                # Don't make the span pay for lamps that can't possibly reach it
+                strength = self._get_lamp_strength(obj, bounds)
+                if strength is None:
+                    print("        [{}] '{}': cannot reach this object, skipping...".format(lamp.type, obj.name))
+                    continue
+
                 # This is probably where PermaLight vs PermaProj should be sorted out...
                 pl_light = self._create_light_key(bo, lamp, None)
                 if self._is_projection_lamp(lamp):
                     print("        [{}] PermaProj '{}'".format(lamp.type, obj.name))
-                    permaProj.append(pl_light)
+                    permaProjs.append((strength, pl_light))
                     # TODO: run this through the material exporter...
                     # need to do some work to make the texture slot code not assume it's working with a material
                 else:
                     print("        [{}] PermaLight '{}'".format(lamp.type, obj.name))
-                    permaLights.append(pl_light)
+                    permaLights.append((strength, pl_light))
+
+        # Optionally, only keep the strongest lamps
+        limit = self._exporter()._op.perma_light_limit
+        for lights in (permaLights, permaProjs):
+            if limit and len(lights) > limit:
+                lights.sort(key=lambda x: x[0], reverse=True)
+                for strength, pl_light in lights[limit:]:
+                    print("        Dropping '{}' -- over the {} light limit".format(pl_light.name, limit))
+                del lights[limit:]
+
+        return ([i[1] for i in permaLights], [i[1] for i in permaProjs])
+
+    def _get_lamp_strength(self, lamp_bo, bounds):
+        """Estimates how strongly a lamp affects an object with the given world bounds, or None
+           if the lamp cannot affect the object at all"""
+        lamp = lamp_bo.data
+        brightness = max((abs(i) for i in get_light_color(lamp)))
+        if lamp.type == "SUN":
+            return brightness
+
+        # If we don't know where the object or the lamp will be, assume they're right on top of
+        # each other.
+        if bounds is None or self._lamp_can_move(lamp_bo):
+            return brightness
+
+        const, linear, quadratic, cutoff = get_attenuation(lamp)
+        bmin, bmax = bounds
+        pos = lamp_bo.matrix_world.to_translation()
+
+        # Closest point on the bounding box to the lamp vs the lamp's cutoff sphere
+        closest = mathutils.Vector([max(bmin[i], min(pos[i], bmax[i])) for i in range(3)])
+        dist = (closest - pos).length
+        if dist > cutoff:
+            return None
+
+        if lamp.type == "SPOT":
+            # Test the bounding sphere of the box against the spot cone. Spots point down -Z.
+            center = (bmin + bmax) * 0.5
+            radius = (bmax - bmin).length * 0.5
+            v = center - pos
+            if v.length > radius:
+                direction = lamp_bo.matrix_world.to_3x3() * mathutils.Vector((0.0, 0.0, -1.0))
+                direction.normalize()
+                a = v.dot(direction)
+                b = math.sqrt(max(v.length_squared - a * a, 0.0))
+                half_angle = lamp.spot_size * 0.5
+                if math.cos(half_angle) * b - math.sin(half_angle) * a > radius:
+                    return None
+
+        return brightness / (const + linear * dist + quadratic * dist * dist)
+
+    def _lamp_can_move(self, lamp_bo):
+        """Determines if a lamp might be somewhere else at runtime than it is now"""
+        # Every lamp is an actor, so that alone says nothing. Parented lamps follow their parent,
+        # and anything that otherwise needs the lamp to be an actor could move it.
+        if lamp_bo.parent is not None:
+            return True
+        return any((mod.requires_actor for mod in self._exporter().get_modifiers(lamp_bo)))
 
-        return (permaLights, permaProjs)
+    def _get_world_bounds(self, bo):
+        """Gets the world space axis aligned bounding box of an object as a (min, max) tuple"""
+        bounds = self._bounds.get(bo)
+        if bounds is None:
+            mat = bo.matrix_world
+            corners = [mat * mathutils.Vector(i) for i in bo.bound_box]
+            bmin = mathutils.Vector([min((i[j] for i in corners)) for j in range(3)])
+            bmax = mathutils.Vector([max((i[j] for i in corners)) for j in range(3)])
+            bounds = (bmin, bmax)
+            self._bounds[bo] = bounds
+        return bounds
 
     def _is_projection_lamp(self, bl_light):
         for tex in bl_light.texture_slots:
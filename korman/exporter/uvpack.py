@@ -0,0 +1,184 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import math
+import numpy
+
+# Bump this whenever the generated UVs change so that cached lightmap UVs are regenerated
+_UVPACK_VERSION = 2
+
+# UVs closer than this are considered to be the same when finding islands
+_UV_PRECISION = 5
+
+def _foreach_get(seq, attr, count, dtype, size=1):
+    buf = numpy.empty(count * size, dtype=dtype)
+    seq.foreach_get(attr, buf)
+    if size == 1:
+        return buf
+    return buf.reshape((count, size))
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+class LightmapUVGenerator:
+    """Unwraps and packs lightmap UVs directly from the mesh data. This replaces the edit mode dance
+       of average_islands_scale/pack_islands (for meshes with UVs) and smart_project (for those
+       without). The result only depends on the mesh data, so it can be cached by fingerprint."""
+
+    def __init__(self, mesh, base_uvtex=None, margin=0.0):
+        num_verts, num_loops, num_polys = len(mesh.vertices), len(mesh.loops), len(mesh.polygons)
+        self._margin = margin
+
+        self._co = _foreach_get(mesh.vertices, "co", num_verts, numpy.float64, 3)
+        self._loop_verts = _foreach_get(mesh.loops, "vertex_index", num_loops, numpy.int32)
+        self._poly_starts = _foreach_get(mesh.polygons, "loop_start", num_polys, numpy.int32)
+        self._poly_totals = _foreach_get(mesh.polygons, "loop_total", num_polys, numpy.int32)
+        self._poly_normals = _foreach_get(mesh.polygons, "normal", num_polys, numpy.float64, 3)
+        self._poly_areas = _foreach_get(mesh.polygons, "area", num_polys, numpy.float64)
+        if base_uvtex is not None:
+            uv_layer = mesh.uv_layers[base_uvtex.name]
+            self._uvs = _foreach_get(uv_layer.data, "uv", num_loops, numpy.float64, 2)
+        else:
+            self._uvs = None
+
+        # Polygon loops are contiguous, so figure out which polygon owns each loop and which loop
+        # comes next around the polygon.
+        order = numpy.argsort(self._poly_starts, kind="mergesort")
+        self._loop_polys = numpy.repeat(order, self._poly_totals[order])
+        self._next_loops = numpy.arange(1, num_loops + 1, dtype=numpy.int32)
+        self._next_loops[self._poly_starts + self._poly_totals - 1] = self._poly_starts
+
+    @property
+    def fingerprint(self):
+        """A digest of everything that goes into the generated UVs"""
+        md5 = hashlib.md5()
+        md5.update(repr((_UVPACK_VERSION, self._margin)).encode())
+        for i in (self._co, self._loop_verts, self._poly_starts, self._poly_totals):
+            md5.update(i.tobytes())
+        if self._uvs is not None:
+            md5.update(self._uvs.tobytes())
+        return md5.hexdigest()
+
+    def generate(self):
+        """Returns a flat array of packed UVs for every loop in the mesh"""
+        if not len(self._poly_starts):
+            return numpy.zeros(len(self._loop_verts) * 2, dtype=numpy.float32)
+        if self._uvs is not None:
+            islands, uvs = self._unwrap_from_uvs()
+        else:
+            islands, uvs = self._unwrap_from_projection()
+        return self._pack(islands, uvs).astype(numpy.float32).ravel()
+
+    def _find_islands(self, edge_keys):
+        """Joins polygons that share an edge key into islands. Returns the island of each polygon."""
+        loop_polys = self._loop_polys.tolist()
+        parent = list(range(len(self._poly_starts)))
+        edges = {}
+        for loop, key in enumerate(edge_keys):
+            poly = loop_polys[loop]
+            other = edges.setdefault(key, poly)
+            if other != poly:
+                a, b = _find(parent, poly), _find(parent, other)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        roots = [_find(parent, i) for i in range(len(parent))]
+        return numpy.unique(roots, return_inverse=True)[1]
+
+    def _unwrap_from_uvs(self):
+        """Uses the islands of the base UV map, scaled so that they all have the same texel density"""
+        loop_verts, next_loops = self._loop_verts.tolist(), self._next_loops.tolist()
+        rounded = [tuple(i) for i in numpy.round(self._uvs, _UV_PRECISION).tolist()]
+
+        def edge_keys():
+            for loop, next_loop in enumerate(next_loops):
+                a = (loop_verts[loop], rounded[loop])
+                b = (loop_verts[next_loop], rounded[next_loop])
+                yield (a, b) if a < b else (b, a)
+        islands = self._find_islands(edge_keys())
+
+        # Equivalent of average_islands_scale: match each island's UV area to its surface area
+        uvs = self._uvs
+        nxt = uvs[self._next_loops]
+        cross = uvs[:, 0] * nxt[:, 1] - nxt[:, 0] * uvs[:, 1]
+        num_polys, num_islands = len(self._poly_starts), islands.max() + 1
+        poly_uv_areas = numpy.abs(numpy.bincount(self._loop_polys, weights=cross, minlength=num_polys)) * 0.5
+        uv_areas = numpy.bincount(islands, weights=poly_uv_areas, minlength=num_islands)
+        areas = numpy.bincount(islands, weights=self._poly_areas, minlength=num_islands)
+        scale = numpy.sqrt(areas / numpy.maximum(uv_areas, 1e-12))
+        scale[uv_areas < 1e-12] = 1.0
+        return islands, uvs * scale[islands[self._loop_polys]][:, numpy.newaxis]
+
+    def _unwrap_from_projection(self):
+        """Projects each polygon along its dominant axis, joining neighbors that share an axis"""
+        normals = self._poly_normals
+        axes = numpy.argmax(numpy.abs(normals), axis=1)
+        signs = numpy.where(normals[numpy.arange(len(axes)), axes] < 0.0, -1.0, 1.0)
+        buckets = (axes * 2 + (signs < 0.0)).tolist()
+
+        loop_verts, next_loops = self._loop_verts.tolist(), self._next_loops.tolist()
+        loop_polys = self._loop_polys.tolist()
+
+        def edge_keys():
+            for loop, next_loop in enumerate(next_loops):
+                a, b = loop_verts[loop], loop_verts[next_loop]
+                yield (min(a, b), max(a, b), buckets[loop_polys[loop]])
+        islands = self._find_islands(edge_keys())
+
+        # Drop the dominant axis. U cross V has to point along the normal for nothing to be flipped,
+        # so mirror U for the negative facing polygons and for +Y, where X cross Z points along -Y.
+        u_axes = numpy.array((1, 0, 0))[axes][self._loop_polys]
+        v_axes = numpy.array((2, 2, 1))[axes][self._loop_polys]
+        u_signs = (numpy.array((1.0, -1.0, 1.0))[axes] * signs)[self._loop_polys]
+        co = self._co[self._loop_verts]
+        loops = numpy.arange(len(co))
+        uvs = numpy.column_stack((co[loops, u_axes] * u_signs, co[loops, v_axes]))
+        return islands, uvs
+
+    def _pack(self, poly_islands, uvs):
+        """Shelf packs the island bounding boxes into the unit square"""
+        islands = poly_islands[self._loop_polys]
+        num_islands = poly_islands.max() + 1
+
+        mins = numpy.full((num_islands, 2), numpy.inf)
+        maxs = numpy.full((num_islands, 2), -numpy.inf)
+        numpy.minimum.at(mins, islands, uvs)
+        numpy.maximum.at(maxs, islands, uvs)
+        sizes = maxs - mins
+
+        # The margin is a fraction of the final texture, which is roughly the square root of the
+        # area we're packing.
+        pad = self._margin * math.sqrt(max((sizes[:, 0] * sizes[:, 1]).sum(), 1e-12))
+        padded = sizes + pad * 2.0
+        width = max(padded[:, 0].max(), math.sqrt((padded[:, 0] * padded[:, 1]).sum()))
+
+        # Tallest islands first, ties broken by index to stay deterministic
+        order = numpy.lexsort((numpy.arange(num_islands), -padded[:, 1]))
+        offsets = numpy.zeros((num_islands, 2))
+        x, y, row_height = 0.0, 0.0, 0.0
+        for i in order.tolist():
+            w, h = padded[i]
+            if x > 0.0 and x + w > width:
+                x, y, row_height = 0.0, y + row_height, 0.0
+            offsets[i] = (x + pad, y + pad)
+            x += w
+            row_height = max(row_height, h)
+
+        side = max(width, y + row_height, 1e-12)
+        return (uvs - mins[islands] + offsets[islands]) / side
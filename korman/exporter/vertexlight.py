@@ -0,0 +1,267 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import concurrent.futures
+import math
+import mathutils
+import numpy
+import os
+
+try:
+    from mathutils.bvhtree import BVHTree
+except ImportError:
+    # Blender 2.75 and older don't have BVH trees, so no shadows for you!
+    BVHTree = None
+
+from .. import helpers
+from .rtlight import get_attenuation, get_light_color
+
+# Pushes shadow rays off of the surface so the surface doesn't shadow itself
+_SHADOW_BIAS = 0.001
+
+def _foreach_get(seq, attr, count, dtype, size=1):
+    buf = numpy.empty(count * size, dtype=dtype)
+    seq.foreach_get(attr, buf)
+    if size == 1:
+        return buf
+    return buf.reshape((count, size))
+
+
+class _LampData:
+    """Everything we need to know about a Blender Lamp, harvested up front so that the lighting
+       math never has to touch the Blender API"""
+
+    def __init__(self, bo):
+        lamp = bo.data
+        mat = bo.matrix_world
+
+        self.name = bo.name
+        self.type = lamp.type
+        self.color = numpy.array(get_light_color(lamp), dtype=numpy.float64)
+        self.position = numpy.array(mat.to_translation(), dtype=numpy.float64)
+        direction = mat.to_3x3() * mathutils.Vector((0.0, 0.0, -1.0))
+        direction.normalize()
+        self.direction = numpy.array(direction, dtype=numpy.float64)
+        self.shadows = lamp.type != "HEMI" and lamp.shadow_method != "NOSHADOW"
+
+        if self.type in {"POINT", "SPOT"}:
+            self.atten_const, self.atten_linear, self.atten_quadratic, self.cutoff = get_attenuation(lamp)
+        if self.type == "SPOT":
+            # Plasma's spot cone, just like the RT light converter makes it
+            outer = lamp.spot_size
+            inner = outer - (max(0.001, lamp.spot_blend) * outer)
+            self.cos_outer = math.cos(outer * 0.5)
+            self.cos_inner = math.cos(inner * 0.5)
+
+    def evaluate(self, positions, normals):
+        """Computes the unshadowed intensity of this lamp at each of the given points"""
+        if self.type in {"SUN", "HEMI"}:
+            ndotl = numpy.dot(normals, -self.direction)
+            if self.type == "HEMI":
+                return 0.5 + 0.5 * ndotl
+            return numpy.clip(ndotl, 0.0, None)
+
+        to_lamp = self.position - positions
+        dist = numpy.sqrt(numpy.einsum("ij,ij->i", to_lamp, to_lamp))
+        dist = numpy.maximum(dist, 1e-6)
+        to_lamp /= dist[:, numpy.newaxis]
+
+        ndotl = numpy.clip(numpy.einsum("ij,ij->i", normals, to_lamp), 0.0, None)
+        atten = 1.0 / (self.atten_const + self.atten_linear * dist + self.atten_quadratic * dist * dist)
+        intensity = ndotl * atten
+        intensity[dist > self.cutoff] = 0.0
+
+        if self.type == "SPOT":
+            cosang = numpy.dot(-to_lamp, self.direction)
+            spread = max(self.cos_inner - self.cos_outer, 1e-6)
+            intensity *= numpy.clip((cosang - self.cos_outer) / spread, 0.0, 1.0)
+        return intensity
+
+    def ray(self, position):
+        """Returns the (direction, distance) of a shadow ray from a point to this lamp"""
+        if self.type in {"SUN", "HEMI"}:
+            return (-self.direction, 1.0e10)
+        to_lamp = self.position - position
+        dist = numpy.linalg.norm(to_lamp)
+        return (to_lamp / max(dist, 1e-6), dist)
+
+
+class _MeshData:
+    """A plain NumPy copy of the mesh data that we need to light an object"""
+
+    def __init__(self, bo, materials, lamp_indices, num_lamps, ambient):
+        mesh = bo.data
+        self.bo = bo
+        num_verts, num_loops, num_polys = len(mesh.vertices), len(mesh.loops), len(mesh.polygons)
+
+        co = _foreach_get(mesh.vertices, "co", num_verts, numpy.float64, 3)
+        normals = _foreach_get(mesh.vertices, "normal", num_verts, numpy.float64, 3)
+        self.loop_verts = _foreach_get(mesh.loops, "vertex_index", num_loops, numpy.int32)
+
+        # Which material each loop uses... Polygon loops are contiguous, so this is easy.
+        poly_mats = _foreach_get(mesh.polygons, "material_index", num_polys, numpy.int32)
+        poly_starts = _foreach_get(mesh.polygons, "loop_start", num_polys, numpy.int32)
+        poly_totals = _foreach_get(mesh.polygons, "loop_total", num_polys, numpy.int32)
+        poly_mats = numpy.clip(poly_mats, 0, len(materials) - 1)
+        order = numpy.argsort(poly_starts)
+        self.loop_mats = numpy.repeat(poly_mats[order], poly_totals[order])
+
+        # Transform everything into world space
+        mat = numpy.array(bo.matrix_world, dtype=numpy.float64)
+        self.positions = co.dot(mat[:3, :3].T) + mat[:3, 3]
+        normal_mat = numpy.linalg.inv(mat[:3, :3]).T
+        normals = normals.dot(normal_mat.T)
+        lengths = numpy.linalg.norm(normals, axis=1)
+        self.normals = normals / numpy.maximum(lengths, 1e-6)[:, numpy.newaxis]
+
+        # Materials tell us what color the surface is and which lamps light it
+        self.diffuse = numpy.ones((len(materials), 3), dtype=numpy.float64)
+        self.ambient = numpy.zeros((len(materials), 3), dtype=numpy.float64)
+        self.lamp_mask = numpy.zeros((len(materials), num_lamps), dtype=numpy.float64)
+        for i, (bm, indices) in enumerate(zip(materials, lamp_indices)):
+            self.lamp_mask[i, indices] = 1.0
+            if bm is not None:
+                self.diffuse[i] = numpy.array(bm.diffuse_color) * bm.diffuse_intensity
+                self.ambient[i] = numpy.array(ambient) * bm.ambient
+        self.visibility = None
+
+
+class VertexLighter:
+    """Calculates static vertex lighting for meshes on the CPU, replacing Blender Internal vertex
+       color bakes. No render engine, selection, or OpenGL required."""
+
+    def __init__(self, scene=None, use_shadows=True, max_workers=None):
+        self._scene = scene if scene is not None else bpy.context.scene
+        self._use_shadows = use_shadows and BVHTree is not None
+        self._max_workers = max_workers if max_workers else os.cpu_count()
+        self._bvh = None
+        self._lamps = []
+        self._lamp_indices = {}
+        self._lamp_lookup = {}
+
+    def _build_bvh(self):
+        """Builds a single BVH of every renderable mesh in the scene to cast shadow rays against"""
+        vertices, polygons = [], []
+        for bo in self._scene.objects:
+            if bo.type != "MESH" or bo.hide_render:
+                continue
+            mat = bo.matrix_world
+            offset = len(vertices)
+            vertices.extend((mat * i.co for i in bo.data.vertices))
+            polygons.extend(([offset + j for j in i.vertices] for i in bo.data.polygons))
+        return BVHTree.FromPolygons(vertices, polygons)
+
+    def _get_lamp_indices(self, bm):
+        """Gets the indices of the lamps that light a given material"""
+        indices = self._lamp_indices.get(bm)
+        if indices is not None:
+            return indices
+
+        # Same rules as the old lightgroup dance: use the material's light group, or every lamp if
+        # it doesn't have one, but never the Plasma RT lamps.
+        lg = bm.light_group if bm is not None else None
+        if not lg or len(lg.objects) == 0:
+            source = helpers.fetch_lamp_objects()
+        else:
+            source = lg.objects
+
+        indices = []
+        for obj in source:
+            if obj.type != "LAMP" or obj.plasma_object.enabled:
+                continue
+            if obj.data.type not in {"POINT", "SPOT", "SUN", "HEMI"}:
+                print("    Vertex lighting: '{}' is a {} lamp, which isn't supported".format(obj.name, obj.data.type))
+                continue
+            idx = self._lamp_lookup.get(obj.name)
+            if idx is None:
+                idx = len(self._lamps)
+                self._lamp_lookup[obj.name] = idx
+                self._lamps.append(_LampData(obj))
+            indices.append(idx)
+        self._lamp_indices[bm] = indices
+        return indices
+
+    def light(self, objects):
+        """Lights a batch of mesh objects, storing the result in their 'autocolor' vertex color layer"""
+        world = self._scene.world
+        ambient = world.ambient_color if world is not None else (0.0, 0.0, 0.0)
+
+        # Phase 1: Harvest everything we need from Blender. Find all the lamps first so that
+        #          every mesh agrees on how many there are.
+        harvest = []
+        for bo in objects:
+            materials = list(bo.data.materials) if bo.data.materials else [None]
+            harvest.append((bo, materials, [self._get_lamp_indices(bm) for bm in materials]))
+        num_lamps = len(self._lamps)
+        batch = [_MeshData(bo, materials, indices, num_lamps, ambient) for bo, materials, indices in harvest]
+
+        # Phase 2: Shadows. BVH ray casts hold the GIL, so don't bother threading these...
+        if self._use_shadows and any((i.shadows for i in self._lamps)):
+            if self._bvh is None:
+                self._bvh = self._build_bvh()
+            for data in batch:
+                data.visibility = self._cast_shadows(data)
+
+        # Phase 3: The actual lighting math is all NumPy, which releases the GIL, so farm it out
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            results = list(executor.map(self._compute, batch))
+
+        # Phase 4: Stuff the colors back into Blender
+        for data, colors in zip(batch, results):
+            self._store_colors(data.bo, colors)
+
+    def _cast_shadows(self, data):
+        visibility = numpy.ones((len(data.positions), len(self._lamps)), dtype=numpy.float64)
+        used = numpy.flatnonzero(data.lamp_mask.any(axis=0))
+        for i in used:
+            lamp = self._lamps[i]
+            if not lamp.shadows:
+                continue
+            for j, (position, normal) in enumerate(zip(data.positions, data.normals)):
+                direction, dist = lamp.ray(position)
+                origin = mathutils.Vector(position + normal * _SHADOW_BIAS)
+                hit = self._bvh.ray_cast(origin, mathutils.Vector(direction), dist)
+                if hit[0] is not None:
+                    visibility[j, i] = 0.0
+        return visibility
+
+    def _compute(self, data):
+        num_lamps = data.lamp_mask.shape[1]
+        intensities = numpy.zeros((len(data.positions), num_lamps), dtype=numpy.float64)
+        colors = numpy.zeros((num_lamps, 3), dtype=numpy.float64)
+        for i in numpy.flatnonzero(data.lamp_mask.any(axis=0)):
+            lamp = self._lamps[i]
+            intensities[:, i] = lamp.evaluate(data.positions, data.normals)
+            colors[i] = lamp.color
+        if data.visibility is not None:
+            intensities *= data.visibility
+
+        # Per-loop lighting only includes the lamps that the loop's material allows
+        light = (intensities[data.loop_verts] * data.lamp_mask[data.loop_mats]).dot(colors)
+        light += data.ambient[data.loop_mats]
+        return numpy.clip(light * data.diffuse[data.loop_mats], 0.0, 1.0)
+
+    def _store_colors(self, bo, colors):
+        vcols = bo.data.vertex_colors
+
+        # I have heard tale of some moar "No valid image to bake to" boogs if there is a really
+        # old copy of the autocolor layer on the mesh. Nuke it.
+        autocolor = vcols.get("autocolor")
+        if autocolor is not None:
+            vcols.remove(autocolor)
+        autocolor = vcols.new("autocolor")
+        autocolor.data.foreach_set("color", colors.astype(numpy.float32).ravel())
+        bo.data.update()
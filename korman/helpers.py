@@ -62,6 +62,11 @@ def ensure_object_can_bake(bo, toggle):
 def ensure_power_of_two(value):
     return pow(2, math.floor(math.log(value, 2)))
 
+def fetch_lamp_objects():
+    for obj in bpy.data.objects:
+        if obj.type == "LAMP":
+            yield obj
+
 def find_modifier(boname, modid):
     """Given a Blender Object name, finds a given modifier and returns it or None"""
     bo = bpy.data.objects.get(boname, None)
@@ -70,11 +75,43 @@ def find_modifier(boname, modid):
         return getattr(bo.plasma_modifiers, modid)
     return None
 
-def make_active_selection(bo):
-    """Selects a single Blender Object and makes it active"""
-    for i in bpy.data.objects:
-        if i == bo:
-            bpy.context.scene.objects.active = i
+class SelectionTracker:
+    """Tracks the object selection so we can change it cheaply and put it back exactly once.
+       Only the objects whose selection state actually differs are touched."""
+
+    def __init__(self):
+        # One walk over everything up front. Objects on hidden layers can still be selected, and
+        # the bake operators will happily bake those too once we unhide all the layers...
+        self._active = bpy.context.scene.objects.active
+        self._original = frozenset((i for i in bpy.data.objects if i.select))
+        self._selected = set(self._original)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.restore()
+
+    def restore(self):
+        """Restores the selection that was present when we started tracking"""
+        for i in self._selected - self._original:
+            i.select = False
+        for i in self._original - self._selected:
             i.select = True
-        else:
+        self._selected = set(self._original)
+        bpy.context.scene.objects.active = self._active
+
+    def select(self, objects, active=None):
+        """Selects only the given Blender Objects, optionally making one of them active"""
+        objects = set(objects)
+        for i in self._selected - objects:
             i.select = False
+        for i in objects - self._selected:
+            i.select = True
+        self._selected = objects
+        if active is not None:
+            bpy.context.scene.objects.active = active
+
+    def select_only(self, bo):
+        """Selects a single Blender Object and makes it active"""
+        self.select((bo,), bo)
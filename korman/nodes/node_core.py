@@ -15,8 +15,55 @@
 
 import abc
 import bpy
+from bpy.props import *
 from PyHSPlasma import plMessage, plNotifyMsg
 
+# Compiled PlasmaNodeTreeIndex objects for the trees currently being exported. We can't stash these
+# on the trees themselves, so they live here, keyed by the tree name.
+_tree_indices = {}
+
+class PlasmaNodeTreeIndex:
+    """An immutable snapshot of a node tree's sockets and links, keyed by node name and socket
+       identifier. Building this is linear in the size of the tree, and every lookup after that
+       is a dict hit instead of a walk over the sockets and links."""
+
+    def __init__(self, tree):
+        input_sockets, output_sockets = {}, {}
+        inputs, outputs = {}, {}
+
+        for node in tree.nodes:
+            for socket in node.inputs:
+                key = (node.name, socket.identifier)
+                input_sockets.setdefault(key, socket)
+                inputs[key] = []
+            for socket in node.outputs:
+                key = (node.name, socket.identifier)
+                output_sockets.setdefault(key, socket)
+                outputs[key] = []
+
+        # Links are stored in the same order the sockets would have given them to us
+        for link in tree.links:
+            inputs[(link.to_node.name, link.to_socket.identifier)].append(link.from_node)
+            outputs[(link.from_node.name, link.from_socket.identifier)].append(link.to_node)
+
+        self._input_sockets = input_sockets
+        self._output_sockets = output_sockets
+        self._inputs = { key: tuple(value) for key, value in inputs.items() }
+        self._outputs = { key: tuple(value) for key, value in outputs.items() }
+
+    def input_nodes(self, node, key):
+        return self._inputs[(node.name, key)]
+
+    def input_socket(self, node, key):
+        return self._input_sockets[(node.name, key)]
+
+    def output_nodes(self, node, key):
+        return self._outputs[(node.name, key)]
+
+    def output_socket(self, node, key):
+        return self._output_sockets[(node.name, key)]
+
+
 class PlasmaNodeBase:
     def create_key_name(self, tree):
         return "{}_{}".format(tree.name, self.name)
@@ -39,6 +86,16 @@ class PlasmaNodeBase:
         pass
 
     def find_input(self, key, idname=None):
+        index = _tree_indices.get(self.id_data.name)
+        if index is not None:
+            nodes = index.input_nodes(self, key)
+            if nodes:
+                node = nodes[0]
+                if idname is not None and idname != node.bl_idname:
+                    return None
+                return node
+            return None
+
         for i in self.inputs:
             if i.identifier == key:
                 if i.links:
@@ -51,12 +108,26 @@ class PlasmaNodeBase:
         raise KeyError(key)
 
     def find_input_socket(self, key):
+        index = _tree_indices.get(self.id_data.name)
+        if index is not None:
+            return index.input_socket(self, key)
+
         for i in self.inputs:
             if i.identifier == key:
                 return i
         raise KeyError(key)
 
     def find_output(self, key, idname=None):
+        index = _tree_indices.get(self.id_data.name)
+        if index is not None:
+            nodes = index.output_nodes(self, key)
+            if nodes:
+                node = nodes[0]
+                if idname is not None and idname != node.bl_idname:
+                    return None
+                return node
+            return None
+
         for i in self.outputs:
             if i.identifier == key:
                 if i.links:
@@ -69,6 +140,18 @@ class PlasmaNodeBase:
         raise KeyError(key)
 
     def find_outputs(self, key, idname=None):
+        index = _tree_indices.get(self.id_data.name)
+        if index is not None:
+            try:
+                nodes = index.output_nodes(self, key)
+            except KeyError:
+                return
+            for node in nodes:
+                if idname is not None and idname != node.bl_idname:
+                    continue
+                yield node
+            return
+
         for i in self.outputs:
             if i.identifier == key:
                 for j in i.links:
@@ -78,6 +161,10 @@ class PlasmaNodeBase:
                     yield node
 
     def find_output_socket(self, key):
+        index = _tree_indices.get(self.id_data.name)
+        if index is not None:
+            return index.output_socket(self, key)
+
         for i in self.outputs:
             if i.identifier == key:
                 return i
@@ -145,10 +232,19 @@ class PlasmaNodeTree(bpy.types.NodeTree):
     bl_label = "Plasma"
     bl_icon = "NODETREE"
 
+    logicwiz_fingerprint = StringProperty(description="INTERNAL: Settings the LogicWiz generated this tree from",
+                                          options={"HIDDEN"})
+
     def export(self, exporter, bo, so):
-        # just pass it off to each node
-        for node in self.nodes:
-            node.export(exporter, self, bo, so)
+        # Compile the tree first so that the nodes don't have to keep scanning sockets and links
+        # while they convert themselves. The tree can't change under us during the export.
+        _tree_indices[self.name] = PlasmaNodeTreeIndex(self)
+        try:
+            # just pass it off to each node
+            for node in self.nodes:
+                node.export(exporter, self, bo, so)
+        finally:
+            del _tree_indices[self.name]
 
     @classmethod
     def poll(cls, context):
@@ -65,16 +65,19 @@ class PlasmaResponderNode(PlasmaNodeVariableInput, bpy.types.Node):
         class ResponderStateMgr:
             def __init__(self, respNode, respMod):
                 self.states = []
+                self.state_indices = {}
                 self.parent = respNode
                 self.responder = respMod
 
             def get_state(self, node):
-                for idx, (theNode, theState) in enumerate(self.states):
-                    if theNode == node:
-                        return (idx, theState)
+                idx = self.state_indices.get(node.name)
+                if idx is not None:
+                    return (idx, self.states[idx][1])
                 state = plResponderModifier_State()
                 self.states.append((node, state))
-                return (len(self.states) - 1, state)
+                idx = len(self.states) - 1
+                self.state_indices[node.name] = idx
+                return (idx, state)
 
             def save(self):
                 resp = self.responder
@@ -89,6 +92,46 @@ class PlasmaResponderNode(PlasmaNodeVariableInput, bpy.types.Node):
         stateMgr.save()
 
 
+class _ResponderCommandMgr:
+    """Collects the commands of a responder state and the callbacks they wait on"""
+
+    def __init__(self):
+        self.commands = []
+        self.command_indices = {}
+        self.callbacks = set()
+        self.waits = {}
+
+    def add_command(self, node):
+        cmd = type("ResponderCommand", (), {"msg": None, "waitOn": -1})
+        self.commands.append((node, cmd))
+        idx = len(self.commands) - 1
+        self.command_indices[node.name] = idx
+        return (idx, cmd)
+
+    def add_callback(self, node):
+        """Notes that a command's message calls back to the responder when it finishes"""
+        self.callbacks.add(node.name)
+
+    def add_wait(self, parentCmd):
+        idx = self.command_indices.get(parentCmd.name)
+        if idx is None or parentCmd.name not in self.callbacks:
+            # The parent command didn't export for some reason... Probably no message.
+            # Or it never calls us back. So, wait on nothing!
+            return -1
+        else:
+            wait = len(self.waits)
+            self.waits[wait] = idx
+            return wait
+
+    def save(self, state):
+        for node, cmd in self.commands:
+            # Amusing, PyHSPlasma doesn't actually want a plResponderModifier_Cmd
+            # Meh, I'll let this one slide.
+            state.addCommand(cmd.msg, cmd.waitOn)
+        state.numCallbacks = len(self.waits)
+        state.waitToCmd = self.waits
+
+
 class PlasmaResponderStateNode(PlasmaNodeVariableInput, bpy.types.Node):
     bl_category = "LOGIC"
     bl_idname = "PlasmaResponderStateNode"
@@ -126,38 +169,8 @@ class PlasmaResponderStateNode(PlasmaNodeVariableInput, bpy.types.Node):
             toIdx, toState = stateMgr.get_state(toStateNode)
             state.switchToState = toIdx
 
-        class CommandMgr:
-            def __init__(self):
-                self.commands = []
-                self.waits = {}
-
-            def add_command(self, node):
-                cmd = type("ResponderCommand", (), {"msg": None, "waitOn": -1})
-                self.commands.append((node, cmd))
-                return (len(self.commands) - 1, cmd)
-
-            def add_wait(self, parentCmd):
-                try:
-                    idx = self.commands.index(parentCmd)
-                except ValueError:
-                    # The parent command didn't export for some reason... Probably no message.
-                    # So, wait on nothing!
-                    return -1
-                else:
-                    wait = len(self.waits)
-                    self.waits[wait] = idx
-                    return idx
-
-            def save(self, state):
-                for node, cmd in self.commands:
-                    # Amusing, PyHSPlasma doesn't actually want a plResponderModifier_Cmd
-                    # Meh, I'll let this one slide.
-                    state.addCommand(cmd.msg, cmd.waitOn)
-                state.numCallbacks = len(self.waits)
-                state.waitToCmd = self.waits
-
         # Convert the commands
-        commands = CommandMgr()
+        commands = _ResponderCommandMgr()
         for i in self.find_outputs("cmds", "PlasmaResponderCommandNode"):
             # slight optimization--commands attached to states can't wait on other commands
             # namely because it's impossible to wait on a command that doesn't exist...
@@ -202,6 +215,8 @@ class PlasmaResponderCommandNode(PlasmaNodeBase, bpy.types.Node):
             haveChildren = self.find_output("trigger", "PlasmaResponderCommandNode") is not None
             if haveChildren:
                 nowait = not self._add_msg_callback(exporter, responder, msg)
+                if not nowait:
+                    commandMgr.add_callback(self)
             command.msg = msg
         else:
             nowait = True
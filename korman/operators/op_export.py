@@ -45,8 +45,38 @@ class ExportOperator(bpy.types.Operator):
                                              ("pvMoul", "Myst Online: Uru Live (70)", "Targets the most recent online game", 0)]}),
 
         "use_texture_page": (BoolProperty, {"name": "Use Textures Page",
-                                            "description": "Exports all textures to a dedicated Textures page",
+                                            "description": "Exports textures shared by several pages to a dedicated Textures page",
                                             "default": True}),
+
+        "perma_light_limit": (IntProperty, {"name": "Max Lights per Span",
+                                            "description": "Only keep the strongest runtime lights on each span (0 = unlimited)",
+                                            "min": 0,
+                                            "default": 0}),
+
+        "texture_filter": (EnumProperty, {"name": "Texture Filter",
+                                          "description": "Filter used when resampling textures to a new size",
+                                          "items": [("BOX", "Box", "Average the covered pixels (best for shrinking)"),
+                                                    ("BILINEAR", "Bilinear", "Blend the four nearest pixels"),
+                                                    ("NEAREST", "Nearest", "Use the nearest pixel")],
+                                          "default": "BOX"}),
+
+        "lightmap_workers": (IntProperty, {"name": "Lightmap Bake Workers",
+                                           "description": "Bake lightmaps in this many background Blender processes (0 = bake here)",
+                                           "min": 0,
+                                           "default": 0}),
+
+        "stream_pages": (BoolProperty, {"name": "Stream Pages",
+                                        "description": "Export one page at a time, writing each page to disk as soon as it's finished. Textures.prp stays in memory until the end, and logic can't reach into pages that were already written",
+                                        "default": False}),
+
+        "page_workers": (IntProperty, {"name": "Page Export Workers",
+                                       "description": "Export the pages in this many background Blender processes (0 = export here). Textures stay in the pages that use them, and logic can't reach into other pages",
+                                       "min": 0,
+                                       "default": 0}),
+
+        "write_ir": (BoolProperty, {"name": "Write Intermediate Representation",
+                                    "description": "Also write a copy of the age that exporter/ir.py can rebuild the PRPs from without Blender",
+                                    "default": False}),
     }
 
     # This wigs out and very bad things happen if it's not directly on the operator...
@@ -59,6 +89,12 @@ class ExportOperator(bpy.types.Operator):
         # The crazy mess we're doing with props on the fly means we have to explicitly draw them :(
         layout.prop(age, "version")
         layout.prop(age, "use_texture_page")
+        layout.prop(age, "perma_light_limit")
+        layout.prop(age, "lightmap_workers")
+        layout.prop(age, "texture_filter")
+        layout.prop(age, "stream_pages")
+        layout.prop(age, "page_workers")
+        layout.prop(age, "write_ir")
         layout.prop(age, "profile_export")
 
     def __getattr__(self, attr):
@@ -136,16 +172,11 @@ class ExportOperator(bpy.types.Operator):
 class _UiHelper:
     """This fun little helper makes sure that we don't wreck the UI"""
     def __enter__(self):
-        self.active_object = bpy.context.object
-        self.selected_objects = bpy.context.selected_objects
+        # NOTE: the exporter tracks and restores the object selection itself
         self.layers = tuple(bpy.context.scene.layers)
 
     def __exit__(self, type, value, traceback):
-        for i in bpy.data.objects:
-            i.select = (i in self.selected_objects)
-
         scene = bpy.context.scene
-        scene.objects.active = self.active_object
         scene.layers = self.layers
         scene.update()
 
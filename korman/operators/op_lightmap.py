@@ -15,12 +15,12 @@
 
 import bpy
 from bpy.props import *
+from ..exporter.uvpack import LightmapUVGenerator
+from ..exporter.vertexlight import VertexLighter
 from ..helpers import *
 
-def _fetch_lamp_objects():
-    for obj in bpy.data.objects:
-        if obj.type == "LAMP":
-            yield obj
+# Pixels of padding between lightmap UV islands
+_LIGHTMAP_MARGIN = 2.0
 
 class _LightingOperator:
     def __init__(self):
@@ -48,13 +48,19 @@ class _LightingOperator:
                 # material is not assigned to this material... (why is this even a thing?)
                 continue
 
+            # We might be baking several meshes that share this material
+            if material in self._old_lightgroups:
+                if material.light_group and material.light_group.objects:
+                    shouldibake = True
+                continue
+
             lg = material.light_group
             self._old_lightgroups[material] = lg
 
             if user_lg is None:
                 # TODO: faux-lightgroup caching for the entire export process. you dig?
                 if not lg or len(lg.objects) == 0:
-                    source = _fetch_lamp_objects()
+                    source = fetch_lamp_objects()
                 else:
                     source = lg.objects
                 dest = bpy.data.groups.new("_LIGHTMAPGEN_{}".format(material.name))
@@ -88,6 +94,17 @@ class LightmapAutobakeOperator(_LightingOperator, bpy.types.Operator):
     bl_options = {"INTERNAL"}
 
     light_group = StringProperty(name="Light Group")
+    batch = BoolProperty(name="Batch",
+                         description="Also bake the selected objects that want a lightmap using the same light group",
+                         default=False,
+                         options={"HIDDEN"})
+    stage = EnumProperty(name="Stage",
+                         description="Which part of the lightmap bake to perform",
+                         items=[("ALL", "All", "Prepare the lightmap UVs and images, then bake and pack them"),
+                                ("PREPARE", "Prepare", "Only prepare the lightmap UVs and images"),
+                                ("BAKE", "Bake", "Only bake into previously prepared lightmaps")],
+                         default="ALL",
+                         options={"HIDDEN"})
 
     def __init__(self):
         super().__init__()
@@ -107,78 +124,105 @@ class LightmapAutobakeOperator(_LightingOperator, bpy.types.Operator):
                 return i
         return None
 
-    def execute(self, context):
-        obj = context.active_object
+    def _get_objects(self, context):
+        """Gets all of the objects we should bake in one go. That's the active object and, when
+           batching, any selected objects that want a lightmap using the same light group."""
+        objects = [context.active_object]
+        if not self.batch:
+            return objects
+        for obj in context.selected_objects:
+            if obj == context.active_object or obj.type != "MESH":
+                continue
+            modifier = obj.plasma_modifiers.lightmap
+            if modifier.enabled and modifier.light_group == self.light_group:
+                objects.append(obj)
+        return objects
+
+    def _prepare_object(self, context, obj, toggle):
+        """Creates the LIGHTMAPGEN image and UV texture for an object and returns the image"""
         mesh = obj.data
         modifier = obj.plasma_modifiers.lightmap
         uv_textures = mesh.uv_textures
 
-        with GoodNeighbor() as toggle:
-            # We need to ensure that we bake onto the "BlahObject_LIGHTMAPGEN" image
-            data_images = bpy.data.images
-            im_name = "{}_LIGHTMAPGEN.png".format(obj.name)
-            size = modifier.resolution
-
-            im = data_images.get(im_name)
-            if im is None:
-                im = data_images.new(im_name, width=size, height=size)
-            elif im.size != (size, size):
-                # Force delete and recreate the image because the size is out of date
-                im.user_clear()
-                data_images.remove(im)
-                im = data_images.new(im_name, width=size, height=size)
-
-            # If there is a cached LIGHTMAPGEN uvtexture, nuke it
-            uvtex = uv_textures.get("LIGHTMAPGEN", None)
+        # We need to ensure that we bake onto the "BlahObject_LIGHTMAPGEN" image
+        data_images = bpy.data.images
+        im_name = "{}_LIGHTMAPGEN.png".format(obj.name)
+        size = modifier.resolution
+
+        im = data_images.get(im_name)
+        if im is None:
+            im = data_images.new(im_name, width=size, height=size)
+        elif im.size != (size, size):
+            # Force delete and recreate the image because the size is out of date
+            im.user_clear()
+            data_images.remove(im)
+            im = data_images.new(im_name, width=size, height=size)
+
+        # Make sure the object can be baked to.
+        # TROLLING LOL LOL LOL
+        ensure_object_can_bake(obj, toggle)
+
+        # Originally, we used the lightmap unpack UV operator to make our UV texture, however,
+        # this tended to create sharp edges. There was already a discussion about this on the
+        # Guild of Writers forum, so I'm implementing a code version of dendwaler's process,
+        # as detailed here: http://forum.guildofwriters.org/viewtopic.php?p=62572#p62572
+        # We do this on the raw mesh data now, so no edit mode round trips. If the mesh hasn't
+        # changed since the last time we did this, the cached LIGHTMAPGEN uvtexture is still good.
+        uv_base = self._get_base_uvtex(mesh, modifier)
+        generator = LightmapUVGenerator(mesh, uv_base, _LIGHTMAP_MARGIN / size)
+        fingerprint = generator.fingerprint
+        uvtex = uv_textures.get("LIGHTMAPGEN", None)
+        if uvtex is None or modifier.uv_fingerprint != fingerprint:
             if uvtex is not None:
                 uv_textures.remove(uvtex)
+            uvs = generator.generate()
+            uvtex = uv_textures.new("LIGHTMAPGEN")
+            mesh.uv_layers["LIGHTMAPGEN"].data.foreach_set("uv", uvs)
+            modifier.uv_fingerprint = fingerprint
+        self._associate_image_with_uvtex(uvtex, im)
+
+        # Now, set the new LIGHTMAPGEN uv layer as what we want to render to...
+        for i in uv_textures:
+            value = i.name == "LIGHTMAPGEN"
+            i.active = value
+            i.active_render = value
+        return im
+
+    def execute(self, context):
+        objects = self._get_objects(context)
 
-            # Make sure the object can be baked to. NOTE this also makes sure we can enter edit mode
-            # TROLLING LOL LOL LOL
-            ensure_object_can_bake(obj, toggle)
-
-            # Originally, we used the lightmap unpack UV operator to make our UV texture, however,
-            # this tended to create sharp edges. There was already a discussion about this on the
-            # Guild of Writers forum, so I'm implementing a code version of dendwaler's process,
-            # as detailed here: http://forum.guildofwriters.org/viewtopic.php?p=62572#p62572
-            uv_base = self._get_base_uvtex(mesh, modifier)
-            if uv_base is not None:
-                uv_textures.active = uv_base
-                # this will copy the UVs to the new UV texture
-                uvtex = uv_textures.new("LIGHTMAPGEN")
-                uv_textures.active = uvtex
-                self._associate_image_with_uvtex(uvtex, im)
-                # here we go...
-                bpy.ops.object.mode_set(mode="EDIT")
-                bpy.ops.mesh.select_all(action="SELECT")
-                bpy.ops.uv.average_islands_scale()
-                bpy.ops.uv.pack_islands()
+        with GoodNeighbor() as toggle:
+            toggle.track(context.scene.objects, "active", context.active_object)
+
+            # Set up all of the objects first. Blender Internal bakes every selected object to the
+            # image on its active UV texture, so we only need to pay for the render setup once.
+            if self.stage == "BAKE":
+                images = []
+                for obj in objects:
+                    ensure_object_can_bake(obj, toggle)
+                    images.append(bpy.data.images["{}_LIGHTMAPGEN.png".format(obj.name)])
             else:
-                # same thread, see Sirius's suggestion RE smart unwrap. this seems to yield good
-                # results in my tests. it will be good enough for quick exports.
-                uvtex = uv_textures.new("LIGHTMAPGEN")
-                self._associate_image_with_uvtex(uvtex, im)
-                bpy.ops.object.mode_set(mode="EDIT")
-                bpy.ops.mesh.select_all(action="SELECT")
-                bpy.ops.uv.smart_project()
-            bpy.ops.object.mode_set(mode="OBJECT")
-
-            # Now, set the new LIGHTMAPGEN uv layer as what we want to render to...
-            for i in uv_textures:
-                value = i.name == "LIGHTMAPGEN"
-                i.active = value
-                i.active_render = value
+                images = [self._prepare_object(context, obj, toggle) for obj in objects]
+            if self.stage == "PREPARE":
+                return {"FINISHED"}
 
             # Bake settings
             render = context.scene.render
             toggle.track(render, "use_bake_to_vertex_color", False)
             self._apply_render_settings(render, toggle)
 
-            # Now, we *finally* bake the lightmap...
+            # Now, we *finally* bake the lightmaps...
             light_group = bpy.data.groups[self.light_group] if self.light_group else None
-            if self._generate_lightgroups(mesh, light_group):
+            shouldibake = False
+            for obj in objects:
+                if self._generate_lightgroups(obj.data, light_group):
+                    shouldibake = True
+            if shouldibake:
                 bpy.ops.object.bake_image()
-                im.pack(as_png=True)
+                # Bake farm workers save the images to disk for the exporter instead
+                if self.stage == "ALL":
+                    for im in images:
+                        im.pack(as_png=True)
             self._pop_lightgroups()
 
         # Done!
@@ -215,39 +259,15 @@ class VertexColorLightingOperator(_LightingOperator, bpy.types.Operator):
     def __init__(self):
         super().__init__()
 
-    def execute(self, context):
-        with GoodNeighbor() as toggle:
-            obj = context.active_object
-            mesh = obj.data
-            vcols = mesh.vertex_colors
-
-            # I have heard tale of some moar "No valid image to bake to" boogs if there is a really
-            # old copy of the autocolor layer on the mesh. Nuke it.
-            autocolor = vcols.get("autocolor")
-            if autocolor is not None:
-                vcols.remove(autocolor)
-            autocolor = vcols.new("autocolor")
-            toggle.track(vcols, "active", autocolor)
-
-            # Mark "autocolor" as our active render layer
-            for vcol_layer in mesh.vertex_colors:
-                autocol = vcol_layer.name == "autocolor"
-                toggle.track(vcol_layer, "active_render", autocol)
-                toggle.track(vcol_layer, "active", autocol)
-            mesh.update()
-
-            # Bake settings
-            render = context.scene.render
-            toggle.track(render, "use_bake_to_vertex_color", True)
-            self._apply_render_settings(render, toggle)
-
-            # Really and truly make sure we can bake...
-            ensure_object_can_bake(obj, toggle)
+    use_shadows = BoolProperty(name="Shadows",
+                               description="Cast shadow rays to shadowing lamps",
+                               default=True)
 
-            # Bake
-            if self._generate_lightgroups(mesh):
-                bpy.ops.object.bake_image()
-            self._pop_lightgroups()
+    def execute(self, context):
+        # We don't need Blender Internal for this anymore, so no render settings, light groups,
+        # or selection shenanigans. Just light the thing.
+        lighter = VertexLighter(context.scene, self.use_shadows)
+        lighter.light([context.active_object])
 
         # And done!
         return {"FINISHED"}
@@ -24,6 +24,9 @@ from .region import *
 from .render import *
 
 class PlasmaModifiers(bpy.types.PropertyGroup):
+    # Filled in at register() time
+    _modifier_names = ()
+
     def determine_next_id(self):
         """Gets the ID for the next modifier in the UI"""
         # This is NOT a property, otherwise the modifiers property would access this...
@@ -39,12 +42,10 @@ class PlasmaModifiers(bpy.types.PropertyGroup):
         """Generates all of the enabled modifiers.
            NOTE: We do not promise to return modifiers in their display_order!
         """
-        for i in dir(self):
-            attr = getattr(self, i, None)
-            # Assumes each modifier is a single pointer to PlasmaModifierProperties
-            if isinstance(attr, PlasmaModifierProperties):
-                if attr.enabled:
-                    yield attr
+        for i in self._modifier_names:
+            attr = getattr(self, i)
+            if attr.enabled:
+                yield attr
 
     @classmethod
     def register(cls):
@@ -63,6 +64,11 @@ class PlasmaModifiers(bpy.types.PropertyGroup):
             setattr(cls, i.pl_id, bpy.props.PointerProperty(type=i))
         bpy.types.Object.plasma_modifiers = bpy.props.PointerProperty(type=cls)
 
+        # Remember the names of the modifier pointers we just made. This saves us from having to
+        # introspect everything on the PropertyGroup every time someone wants the modifiers, which
+        # happens a lot (think UI redraws).
+        cls._modifier_names = tuple(sorted((i.pl_id for i in modifier_definitions())))
+
 
 def _is_plasma_modifier(hClass):
     if inspect.isclass(hClass):
@@ -60,11 +60,9 @@ class PlasmaSittingBehavior(PlasmaModifierProperties, PlasmaModifierLogicWiz):
         if clickable_obj is None:
             raise ExportError("'{}': Sitting Behavior's clickable object is invalid")
 
-        # Generate the logic nodes now
-        self.logicwiz(bo)
-
-        # Now, export the node tree
-        self.node_tree.export(exporter, bo, so)
+        # Generate the logic nodes now (if they're out of date) and export them
+        tree = self.generate_logic(bo)
+        tree.export(exporter, bo, so)
 
     def logicwiz(self, bo):
         tree = self.node_tree
@@ -103,6 +101,13 @@ class PlasmaSittingBehavior(PlasmaModifierProperties, PlasmaModifierLogicWiz):
             # facing target conditional for us. isn't that nice?
             clickable.find_input_socket("facing").allow_simple = False
 
+    def _logicwiz_dependencies(self, bo):
+        # The bounds of the clickable and region colliders get baked into the nodes
+        clickable_phys = find_modifier(self.clickable_obj, "collision")
+        region_phys = find_modifier(self.region_obj, "collision")
+        return (("clickable_bounds", getattr(clickable_phys, "bounds", None)),
+                ("region_bounds", getattr(region_phys, "bounds", None)))
+
     @property
     def requires_actor(self):
         return self.facing_enabled
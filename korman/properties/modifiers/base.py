@@ -16,6 +16,11 @@
 import abc
 import bpy
 from bpy.props import *
+import hashlib
+
+# Bump this whenever any LogicWiz generates different nodes, so trees from older versions of
+# Korman are regenerated instead of being reused.
+_LOGICWIZ_VERSION = 1
 
 class PlasmaModifierProperties(bpy.types.PropertyGroup):
     def created(self, obj):
@@ -52,6 +57,38 @@ class PlasmaModifierProperties(bpy.types.PropertyGroup):
 
 
 class PlasmaModifierLogicWiz:
+    # Properties that have no bearing on the generated logic nodes
+    _logicwiz_ignore = {"rna_type", "display_order", "show_expanded"}
+
+    def generate_logic(self, bo):
+        """Returns this modifier's logic node tree, only running the LogicWiz if the settings have
+           changed since the tree was last generated"""
+        tree = self.node_tree
+        fingerprint = self.logicwiz_fingerprint(bo)
+        if tree.logicwiz_fingerprint != fingerprint or not tree.nodes:
+            print("    Generating logic nodes '{}'".format(tree.name))
+            self.logicwiz(bo)
+            tree.logicwiz_fingerprint = fingerprint
+        return tree
+
+    def logicwiz_fingerprint(self, bo):
+        """Generates a digest of everything the LogicWiz output depends on"""
+        values = [_LOGICWIZ_VERSION, self.__class__.__name__, bo.name]
+        for prop in self.bl_rna.properties:
+            name = prop.identifier
+            if name in self._logicwiz_ignore:
+                continue
+            value = getattr(self, name)
+            if isinstance(value, set):
+                value = sorted(value)
+            values.append((name, value))
+        values.extend(self._logicwiz_dependencies(bo))
+        return hashlib.md5(repr(values).encode()).hexdigest()
+
+    def _logicwiz_dependencies(self, bo):
+        """Returns any settings from outside of this modifier that the LogicWiz uses"""
+        return ()
+
     @property
     def node_tree(self):
         name = self.display_name
@@ -75,11 +75,9 @@ class PlasmaFootstepRegion(PlasmaModifierProperties, PlasmaModifierLogicWiz):
         self.display_name = "{}_FootRgn".format(obj.name)
 
     def export(self, exporter, bo, so):
-        # Generate the logic nodes now
-        self.logicwiz(bo)
-
-        # Now, export the node tree
-        self.node_tree.export(exporter, bo, so)
+        # Generate the logic nodes now (if they're out of date) and export them
+        tree = self.generate_logic(bo)
+        tree.export(exporter, bo, so)
 
     def logicwiz(self, bo):
         tree = self.node_tree
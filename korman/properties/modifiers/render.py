@@ -16,10 +16,15 @@
 
 import bpy
 from bpy.props import *
+import math
 from PyHSPlasma import *
 
 from .base import PlasmaModifierProperties
 
+LIGHTMAP_MIN_SIZE = 128
+_LIGHTMAP_MAX_SIZE = 1024
+_LIGHTMAP_PACK_EFFICIENCY = 0.6
+
 class PlasmaLightMapGen(PlasmaModifierProperties):
     pl_id = "lightmap"
 
@@ -34,6 +39,7 @@ class PlasmaLightMapGen(PlasmaModifierProperties):
                                   ("256", "256px", "256x256 pixels"),
                                   ("512", "512px", "512x512 pixels"),
                                   ("1024", "1024px", "1024x1024 pixels"),
+                                  ("AUTO", "Auto", "Pick the resolution from the object's surface area and the age's texel density"),
                             ])
 
     light_group = StringProperty(name="Light Group",
@@ -42,6 +48,36 @@ class PlasmaLightMapGen(PlasmaModifierProperties):
     uv_map = StringProperty(name="UV Texture",
                             description="UV Texture used as the basis for the lightmap")
 
+    use_compression = BoolProperty(name="Compress",
+                                   description="Export the lightmap as a mipmapped DXT1 texture instead of an uncompressed bitmap",
+                                   default=True)
+
+    # Implementation details
+    auto_resolution = IntProperty(name="INTERNAL: Automatic Resolution",
+                                  options={"HIDDEN"})
+    uv_fingerprint = StringProperty(name="INTERNAL: Lightmap UV Fingerprint",
+                                    options={"HIDDEN"})
+
+    def calc_auto_resolution(self, bo, density):
+        """Picks a lightmap resolution for the object from its world space surface area"""
+        mat = bo.matrix_world
+        mesh = bo.data
+        verts = [mat * i.co for i in mesh.vertices]
+
+        area = 0.0
+        for poly in mesh.polygons:
+            indices = poly.vertices
+            v0 = verts[indices[0]]
+            for i in range(1, len(indices) - 1):
+                area += (verts[indices[i]] - v0).cross(verts[indices[i+1]] - v0).length * 0.5
+
+        # UV islands never pack perfectly, so leave some room for the wasted space
+        texels = area * density * density / _LIGHTMAP_PACK_EFFICIENCY
+        if texels <= 1.0:
+            return LIGHTMAP_MIN_SIZE
+        size = pow(2, math.ceil(math.log(math.sqrt(texels), 2)))
+        return min(max(size, LIGHTMAP_MIN_SIZE), _LIGHTMAP_MAX_SIZE)
+
     def created(self, obj):
         self.display_name = "{}_LIGHTMAPGEN".format(obj.name)
 
@@ -81,8 +117,15 @@ class PlasmaLightMapGen(PlasmaModifierProperties):
             mat.addPiggyBack(layer.key)
 
             # Mmm... cheating
-            mat_mgr.export_prepared_layer(layer, lightmap_im)
+            mat_mgr.export_prepared_layer(layer, lightmap_im, mipmap=self.use_compression, use_alpha=False)
 
     @property
     def resolution(self):
+        if self.quality == "AUTO":
+            # While exporting, the exporter assigns this based on the age's texel density and
+            # memory budget. Otherwise, just go by the current texel density.
+            if self.auto_resolution:
+                return self.auto_resolution
+            age = bpy.context.scene.world.plasma_age
+            return self.calc_auto_resolution(self.id_data, age.lightmap_density)
         return int(self.quality)
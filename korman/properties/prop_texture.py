@@ -25,3 +25,22 @@ class PlasmaLayer(bpy.types.PropertyGroup):
                                   min=0,
                                   max=100,
                                   subtype="PERCENTAGE")
+
+    max_size = EnumProperty(name="Max Size",
+                            description="Largest size this texture may be exported at",
+                            items=[("0", "Unlimited", "Export the texture at its full size"),
+                                   ("64", "64px", "No larger than 64 pixels"),
+                                   ("128", "128px", "No larger than 128 pixels"),
+                                   ("256", "256px", "No larger than 256 pixels"),
+                                   ("512", "512px", "No larger than 512 pixels"),
+                                   ("1024", "1024px", "No larger than 1024 pixels"),
+                                   ("2048", "2048px", "No larger than 2048 pixels")],
+                            default="0")
+    texture_priority = IntProperty(name="Budget Priority",
+                                   description="Textures with a lower priority are downscaled first when over the texture memory budget",
+                                   min=0,
+                                   max=10,
+                                   default=5)
+    use_library = BoolProperty(name="Shared Library",
+                               description="Export this texture into the age's shared texture library instead of the age itself",
+                               default=False)
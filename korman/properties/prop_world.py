@@ -113,6 +113,10 @@ class PlasmaPage(bpy.types.PropertyGroup):
     enabled = BoolProperty(name="Export Page",
                            description="Export this page",
                            default=True)
+    texture_budget = FloatProperty(name="Texture Budget",
+                                   description="Maximum texture memory (in MiB) for this page (0 = unlimited)",
+                                   min=0.0,
+                                   default=0.0)
 
     # Implementation details...
     last_name = StringProperty(description="INTERNAL: Cached page name",
@@ -155,6 +159,24 @@ class PlasmaAge(bpy.types.PropertyGroup):
     age_sdl = BoolProperty(name="Age Global SDL",
                            description="This age has its own SDL file",
                            default=False)
+    texture_budget = FloatProperty(name="Texture Budget",
+                                   description="Maximum texture memory (in MiB) for the whole age (0 = unlimited)",
+                                   min=0.0,
+                                   default=0.0)
+    library_name = StringProperty(name="Texture Library",
+                                  description="Name of the shared texture library age that library textures are exported to")
+    library_prefix = IntProperty(name="Library ID",
+                                 description="Sequence prefix of the shared texture library age",
+                                 default=-10)
+    lightmap_density = FloatProperty(name="Texel Density",
+                                     description="Lightmap texels per Blender unit for automatic lightmap resolutions",
+                                     min=0.01,
+                                     soft_max=256.0,
+                                     default=16.0)
+    lightmap_budget = FloatProperty(name="Memory Budget",
+                                    description="Maximum memory (in MiB) for automatic resolution lightmaps (0 = unlimited)",
+                                    min=0.0,
+                                    default=0.0)
 
     # Implementation details
     active_page_index = IntProperty(name="Active Page Index")
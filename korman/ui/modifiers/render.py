@@ -19,6 +19,7 @@ def lightmap(modifier, layout, context):
     layout.row(align=True).prop(modifier, "quality", expand=True)
     layout.prop_search(modifier, "light_group", bpy.data, "groups", icon="GROUP")
     layout.prop_search(modifier, "uv_map", context.active_object.data, "uv_textures")
+    layout.prop(modifier, "use_compression")
 
     operator = layout.operator("object.plasma_lightmap_preview", "Preview Lightmap", icon="RENDER_STILL")
     operator.light_group = modifier.light_group
@@ -29,4 +29,10 @@ class PlasmaLayerPanel(TextureButtonsPanel, bpy.types.Panel):
 
     def draw(self, context):
         layout = self.layout
-        layout.prop(context.texture.plasma_layer, "opacity")
+        layer_props = context.texture.plasma_layer
+        layout.prop(layer_props, "opacity")
+
+        split = layout.split()
+        split.column().prop(layer_props, "max_size")
+        split.column().prop(layer_props, "texture_priority")
+        layout.prop(layer_props, "use_library")
@@ -65,6 +65,8 @@ class PlasmaAgePanel(AgeButtonsPanel, bpy.types.Panel):
             col.prop(active_page, "name", text="")
             col.prop(active_page, "seq_suffix")
 
+            box.prop(active_page, "texture_budget")
+
         # Core settings
         layout.separator()
         split = layout.split()
@@ -78,6 +80,20 @@ class PlasmaAgePanel(AgeButtonsPanel, bpy.types.Panel):
         col.label("Age Settings:")
         col.prop(age, "seq_prefix", text="ID")
         col.prop(age, "age_sdl")
+        col.prop(age, "texture_budget")
+
+        # Texture library settings
+        layout.separator()
+        split = layout.split()
+        split.column().prop(age, "library_name")
+        split.column().prop(age, "library_prefix")
+
+        # Lightmap settings
+        layout.separator()
+        layout.label("Automatic Lightmaps:")
+        split = layout.split()
+        split.column().prop(age, "lightmap_density")
+        split.column().prop(age, "lightmap_budget")
 
 
 class PlasmaEnvironmentPanel(AgeButtonsPanel, bpy.types.Panel):
@@ -0,0 +1,67 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import types
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from geometry import build_geometry
+
+def _snapshot(positions, faces, face_materials, slots, uvs=None):
+    num_faces = len(faces)
+    if uvs is None:
+        uvs = numpy.zeros((num_faces, 4, 0, 2), dtype=numpy.float32)
+    return types.SimpleNamespace(
+        slots=slots,
+        positions=numpy.array(positions, dtype=numpy.float32),
+        normals=numpy.tile(numpy.array((0.0, 0.0, 1.0), dtype=numpy.float32), (len(positions), 1)),
+        faces=numpy.array(faces, dtype=numpy.int32),
+        face_materials=numpy.array(face_materials, dtype=numpy.int32),
+        uvs=numpy.array(uvs, dtype=numpy.float32),
+        colors=numpy.ones((num_faces, 4, 3), dtype=numpy.float32),
+        alphas=numpy.ones((num_faces, 4), dtype=numpy.float32))
+
+_POSITIONS = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (2, 0, 0), (2, 1, 0)]
+
+def test_quads_and_triangles():
+    # Blender tessfaces with a fourth vertex index of zero are triangles
+    snapshot = _snapshot(_POSITIONS, [(0, 1, 2, 3), (1, 4, 2, 0)], [0, 1], [0, 1])
+    quad, tri = build_geometry(snapshot)
+
+    assert quad["indices"].tolist() == [0, 1, 2, 0, 2, 3]
+    assert quad["positions"].tolist() == [list(i) for i in _POSITIONS[:4]]
+    assert tri["indices"].tolist() == [0, 1, 2]
+    assert tri["positions"].tolist() == [list(_POSITIONS[i]) for i in (1, 4, 2)]
+    assert tri["colors"].tolist() == [[255, 255, 255, 255]] * 3
+    assert tri["uvs"].shape == (3, 0, 2)
+
+def test_shared_corners_are_merged():
+    snapshot = _snapshot(_POSITIONS, [(0, 1, 2, 3), (1, 4, 5, 2)], [0, 0], [0])
+    geometry, = build_geometry(snapshot)
+    assert len(geometry["positions"]) == 6
+    assert geometry["indices"].tolist() == [0, 1, 2, 0, 2, 3, 1, 4, 5, 1, 5, 2]
+
+def test_uv_seams_are_kept():
+    uvs = numpy.zeros((2, 4, 1, 2), dtype=numpy.float32)
+    uvs[1, :, 0, 0] = 1.0
+    snapshot = _snapshot(_POSITIONS, [(0, 1, 2, 3), (1, 4, 5, 2)], [0, 0], [0], uvs)
+    geometry, = build_geometry(snapshot)
+    assert len(geometry["positions"]) == 8
+    assert geometry["uvs"].shape == (8, 1, 2)
+
+def test_unused_material():
+    snapshot = _snapshot(_POSITIONS, [(0, 1, 2, 3)], [0], [0, 1])
+    assert build_geometry(snapshot)[1] is None
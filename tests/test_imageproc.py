@@ -0,0 +1,57 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import imageproc
+
+def _solid(width, height, color):
+    return numpy.tile(numpy.array(color, dtype=numpy.uint8), (height, width, 1))
+
+def test_classify_alpha():
+    pixels = _solid(2, 2, (10, 20, 30, 255))
+    assert imageproc.classify_alpha(pixels) == "NONE"
+    pixels[0, 0, 3] = 0
+    assert imageproc.classify_alpha(pixels) == "BINARY"
+    pixels[0, 1, 3] = 128
+    assert imageproc.classify_alpha(pixels) == "FULL"
+
+def test_box_averages():
+    pixels = numpy.array([[[0, 0, 0, 255], [100, 100, 100, 255]],
+                          [[200, 200, 200, 255], [100, 100, 100, 255]]], dtype=numpy.uint8)
+    result = imageproc.resample(pixels, 1, 1, "BOX")
+    assert result.tolist() == [[[100, 100, 100, 255]]]
+
+@pytest.mark.parametrize("filter", ("BOX", "BILINEAR", "NEAREST"))
+def test_resample_keeps_solid_color(filter):
+    result = imageproc.resample(_solid(8, 4, (12, 34, 56, 78)), 2, 2, filter)
+    assert result.shape == (2, 2, 4)
+    assert result.dtype == numpy.uint8
+    assert (result == (12, 34, 56, 78)).all()
+
+def test_resample_same_size():
+    pixels = _solid(4, 4, (1, 2, 3, 4))
+    assert imageproc.resample(pixels, 4, 4) is pixels
+
+def test_generate_levels():
+    levels = list(imageproc.generate_levels(_solid(8, 4, (10, 20, 30, 40)), 4, quiet=True))
+    assert [len(i) for i in levels] == [8 * 4 * 4, 4 * 2 * 4, 2 * 1 * 4, 1 * 1 * 4]
+    assert levels[-1] == bytes((10, 20, 30, 40))
+
+def test_generate_levels_bgra_and_calc_alpha():
+    level = next(imageproc.generate_levels(_solid(1, 1, (10, 20, 60, 255)), 1, calc_alpha=True, bgra=True, quiet=True))
+    assert level == bytes((60, 20, 10, 30))
@@ -0,0 +1,110 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os.path
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PyHSPlasma")
+
+from PyHSPlasma import *
+import ir
+
+class _PageManager:
+    """The parts of ExportManager that the IRWriter uses to name pages"""
+
+    def __init__(self, pages):
+        self._pages = pages
+
+    def get_page_name(self, location):
+        return next(name for name, i in self._pages.items() if i == location)
+
+    def get_pages(self):
+        return self._pages
+
+
+def _scene(layers, materials):
+    return {"version": ir.IR_VERSION, "plasma_version": "pvPots",
+            "age": {"name": "Test", "seqPrefix": 100, "dayLength": 24.0, "lingerTime": 180,
+                    "maxCapacity": -1, "startDateTime": 0, "sdl": False},
+            "fni": [], "pages": [{"name": "Page", "id": 0, "builtin": False}], "library": None,
+            "dspans": [], "drawables": [], "mipmaps": [], "objects": [], "materials": materials,
+            "layers": layers, "physicals": [], "skipped": {}}
+
+def _round_trip(tmp_path, location, layers, materials):
+    """Writes the layers and materials to the IR, builds the age, and reads the page back"""
+    mgr = _PageManager({"Page": location})
+    path = str(tmp_path / "ir")
+    writer = ir.IRWriter(path)
+    scene = _scene([writer._get_layer(mgr, "Page", i) for i in layers],
+                   [writer._get_material(mgr, "Page", i) for i in materials])
+    writer._buffers.close()
+    with open(os.path.join(path, "scene.json"), "w") as handle:
+        json.dump(scene, handle)
+
+    ir.IRBuilder(path).build(str(tmp_path))
+    rm = plResManager()
+    info = rm.ReadPage(str(tmp_path / ir._get_page_filename(pvPots, "Test", "Page")))
+    return rm, info.location
+
+def _location():
+    location = plLocation(pvPots)
+    location.prefix = 100
+    location.page = 0
+    return location
+
+def test_material_piggybacks(tmp_path):
+    location = _location()
+    rm = plResManager()
+    rm.setVer(pvPots)
+    base, lightmap, hsgmat = plLayer("Base"), plLayer("Lightmap"), hsGMaterial("Material")
+    for i in (base, lightmap, hsgmat):
+        rm.AddObject(location, i)
+    hsgmat.addLayer(base.key)
+    hsgmat.addPiggyBack(lightmap.key)
+
+    built, location = _round_trip(tmp_path, location, (base, lightmap), (hsgmat,))
+    keys = built.getKeys(location, plFactory.ClassIndex("hsGMaterial"))
+    assert len(keys) == 1
+    assert [i.name for i in keys[0].object.layers] == ["Base"]
+    assert [i.name for i in keys[0].object.piggyBacks] == ["Lightmap"]
+
+def test_unsupported_texture_is_skipped(tmp_path):
+    location = _location()
+    rm = plResManager()
+    rm.setVer(pvPots)
+    layer, envmap = plLayer("Layer"), plCubicEnvironmap("EnvMap")
+    for i in (layer, envmap):
+        rm.AddObject(location, i)
+    layer.texture = envmap.key
+
+    built, location = _round_trip(tmp_path, location, (layer,), ())
+    keys = built.getKeys(location, plFactory.ClassIndex("plLayer"))
+    assert len(keys) == 1
+    assert keys[0].object.texture is None
+
+def test_incomplete_ir_is_refused(tmp_path):
+    path = str(tmp_path / "ir")
+    ir.IRWriter(path)._buffers.close()
+    scene = _scene([], [])
+    scene["skipped"] = {"plResponderModifier": 1}
+    with open(os.path.join(path, "scene.json"), "w") as handle:
+        json.dump(scene, handle)
+
+    with pytest.raises(ValueError):
+        ir.IRBuilder(path).build(str(tmp_path))
+    ir.IRBuilder(path, allow_incomplete=True).build(str(tmp_path))
+    assert (tmp_path / ir._get_page_filename(pvPots, "Test", "Page")).is_file()
@@ -0,0 +1,49 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import irbuffers
+
+def _round_trip(path, arrays):
+    writer = irbuffers.BufferWriter(path)
+    descs = [writer.add(i) for i in arrays]
+    writer.close()
+    reader = irbuffers.BufferReader(path)
+    return descs, [reader.get(i) for i in descs]
+
+def test_arrays_are_aligned(tmp_path):
+    arrays = [numpy.arange(3, dtype=numpy.uint8),
+              numpy.arange(12, dtype=numpy.float32).reshape((4, 3)),
+              numpy.arange(5, dtype=numpy.int32),
+              numpy.ones((2, 3, 2), dtype=numpy.float64)]
+    descs, results = _round_trip(str(tmp_path / "buffers.bin"), arrays)
+    assert [i["offset"] % 16 for i in descs] == [0] * len(arrays)
+    for array, result in zip(arrays, results):
+        assert result.dtype == array.dtype
+        assert result.shape == array.shape
+        assert (result == array).all()
+
+def test_noncontiguous_array(tmp_path):
+    array = numpy.arange(6, dtype=numpy.int32).reshape((2, 3)).T
+    descs, results = _round_trip(str(tmp_path / "buffers.bin"), [array])
+    assert (results[0] == array).all()
+
+def test_empty_arrays(tmp_path):
+    arrays = [numpy.zeros((0, 3), dtype=numpy.float32)]
+    descs, results = _round_trip(str(tmp_path / "buffers.bin"), arrays)
+    assert results[0].shape == (0, 3)
@@ -0,0 +1,49 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import pytest
+
+# The node modules can only be imported inside of Blender
+pytest.importorskip("bpy")
+pytest.importorskip("PyHSPlasma")
+
+from korman.nodes.node_responder import _ResponderCommandMgr
+
+_Node = collections.namedtuple("_Node", ("name",))
+
+def test_wait_is_registered():
+    mgr = _ResponderCommandMgr()
+    first, parent, child = _Node("first"), _Node("parent"), _Node("child")
+    mgr.add_command(first)
+    mgr.add_command(parent)
+    mgr.add_callback(parent)
+    mgr.add_command(child)
+
+    # The child waits on the first callback, which belongs to the second command
+    assert mgr.add_wait(parent) == 0
+    assert mgr.waits == {0: 1}
+
+def test_wait_without_callback():
+    mgr = _ResponderCommandMgr()
+    parent = _Node("parent")
+    mgr.add_command(parent)
+    assert mgr.add_wait(parent) == -1
+    assert mgr.waits == {}
+
+def test_wait_on_missing_command():
+    mgr = _ResponderCommandMgr()
+    assert mgr.add_wait(_Node("nowhere")) == -1
+    assert mgr.waits == {}
@@ -0,0 +1,74 @@
+#    This file is part of Korman.
+#
+#    Korman is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Korman is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Korman.  If not, see <http://www.gnu.org/licenses/>.
+
+import types
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from uvpack import LightmapUVGenerator
+
+class _Collection:
+    """Just enough of a bpy collection for foreach_get"""
+
+    def __init__(self, **attrs):
+        self._attrs = {name: numpy.asarray(value) for name, value in attrs.items()}
+        self._len = len(next(iter(self._attrs.values())))
+
+    def __len__(self):
+        return self._len
+
+    def foreach_get(self, attr, buf):
+        buf[:] = self._attrs[attr].ravel()
+
+
+# A unit cube with every face wound counterclockwise when seen from outside
+_VERTICES = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)]
+_FACES = [((0, 3, 2, 1), (0, 0, -1)), ((4, 5, 6, 7), (0, 0, 1)),
+          ((0, 1, 5, 4), (0, -1, 0)), ((2, 3, 7, 6), (0, 1, 0)),
+          ((0, 4, 7, 3), (-1, 0, 0)), ((1, 2, 6, 5), (1, 0, 0))]
+
+def _cube():
+    return types.SimpleNamespace(
+        vertices=_Collection(co=_VERTICES),
+        loops=_Collection(vertex_index=[i for face, normal in _FACES for i in face]),
+        polygons=_Collection(loop_start=[i * 4 for i in range(len(_FACES))],
+                             loop_total=[4] * len(_FACES),
+                             normal=[normal for face, normal in _FACES],
+                             area=[1.0] * len(_FACES)))
+
+def test_projection_fits_unit_square():
+    uvs = LightmapUVGenerator(_cube(), margin=0.01).generate().reshape((-1, 2))
+    assert len(uvs) == 24
+    assert (uvs >= 0.0).all() and (uvs <= 1.0).all()
+
+def test_projection_is_not_mirrored():
+    uvs = LightmapUVGenerator(_cube()).generate().reshape((-1, 4, 2))
+    for face in uvs:
+        # Shoelace formula: counterclockwise faces have a positive signed area
+        x, y = face[:, 0], face[:, 1]
+        area = (x * numpy.roll(y, -1) - numpy.roll(x, -1) * y).sum() * 0.5
+        assert area > 0.0
+
+def test_islands_do_not_overlap():
+    uvs = LightmapUVGenerator(_cube(), margin=0.01).generate().reshape((-1, 4, 2))
+    boxes = [(face.min(axis=0), face.max(axis=0)) for face in uvs]
+    for i, (amin, amax) in enumerate(boxes):
+        for bmin, bmax in boxes[i+1:]:
+            assert (amax <= bmin + 1e-6).any() or (bmax <= amin + 1e-6).any()
+
+def test_fingerprint():
+    assert LightmapUVGenerator(_cube()).fingerprint == LightmapUVGenerator(_cube()).fingerprint
+    assert LightmapUVGenerator(_cube()).fingerprint != LightmapUVGenerator(_cube(), margin=0.01).fingerprint